@@ -3,7 +3,10 @@ Functions ported directly from django-raster.
 
 Source: https://github.com/geodesign/django-raster/blob/master/raster/utils.py
 """
+from functools import lru_cache
+
 import numpy
+from wmts.algebra import const
 
 
 def rescale_to_channel_range(data, dfrom, dto, dover=None):
@@ -51,6 +54,39 @@ def rescale_to_channel_range(data, dfrom, dto, dover=None):
         return data
 
 
+@lru_cache(maxsize=const.COLORMAP_CACHE_SIZE)
+def continuous_lut(color_from, color_to, color_over, size=const.COLORMAP_LUT_SIZE):
+    """
+    Compute the RGBA lookup table for a continuous colormap.
+
+    Parameters
+    ----------
+    color_from : tuple
+        Start color of the colormap.
+    color_to : tuple
+        End color of the colormap.
+    color_over : tuple
+        Middle color of the colormap, the channels can be None.
+    size : int, optional
+        Number of color levels in the table.
+
+    Returns
+    -------
+    lut : array
+        Read only RGBA UInt8 array with one row for each of the levels between
+        zero and one, and a transparent row at the end.
+    """
+    levels = numpy.linspace(0, 1, size)
+    lut = numpy.zeros((size + 1, 4), dtype="uint8")
+    for channel in range(3):
+        lut[:size, channel] = rescale_to_channel_range(
+            levels.copy(), color_from[channel], color_to[channel], color_over[channel]
+        )
+    lut[:size, 3] = 255
+    lut.flags.writeable = False
+    return lut
+
+
 def colorize(data, colormap):
     """
     Creates a python image from pixel values of a GDALRaster.
@@ -92,48 +128,69 @@ def colorize(data, colormap):
         else:
             norm = (dat - dmin) / (dmax - dmin)
 
-        color_from = colormap.get("from", [0, 0, 0])
-        color_to = colormap.get("to", [1, 1, 1])
-        color_over = colormap.get("over", [None, None, None])
-
-        red = rescale_to_channel_range(
-            norm.copy(), color_from[0], color_to[0], color_over[0]
-        )
-        green = rescale_to_channel_range(
-            norm.copy(), color_from[1], color_to[1], color_over[1]
-        )
-        blue = rescale_to_channel_range(
-            norm.copy(), color_from[2], color_to[2], color_over[2]
+        lut = continuous_lut(
+            tuple(colormap.get("from", [0, 0, 0])),
+            tuple(colormap.get("to", [1, 1, 1])),
+            tuple(colormap.get("over", [None, None, None])),
         )
+        size = lut.shape[0] - 1
 
         # Compute alpha channel from mask if available.
-        if numpy.ma.is_masked(dat):
-            alpha = 255 * numpy.logical_not(dat.mask) * (norm >= 0) * (norm <= 1)
-        else:
-            alpha = 255 * (norm > 0) * (norm < 1)
+        norm = numpy.ma.getdata(norm)
+        with numpy.errstate(invalid="ignore"):
+            if numpy.ma.is_masked(dat):
+                visible = numpy.logical_not(dat.mask) & (norm >= 0) & (norm <= 1)
+            else:
+                visible = (norm > 0) & (norm < 1)
 
-        rgba = numpy.array([red, green, blue, alpha], dtype="uint8").T
-    else:
-        # Create zeros array.
+        # Quantize the normalized data to the lookup table levels, invisible
+        # pixels point to the transparent last row of the table.
+        index = norm * (size - 1.0)
+        index += 0.5
+        index[numpy.logical_not(visible)] = size
+
+        rgba = lut.take(index.astype("intp"), axis=0)
+    elif not colormap:
+        # Without classes all pixels are transparent.
         rgba = numpy.zeros((dat.shape[0], 4), dtype="uint8")
+    else:
+        keys = list(colormap)
+        # Sort the class values, the colors are in the same order with a
+        # transparent row at the end for pixels that match no class.
+        values = numpy.array([float(key) for key in keys])
+        order = numpy.argsort(values, kind="stable")
+        values = values[order]
+        lut = numpy.zeros((len(keys) + 1, 4), dtype="uint8")
+        lut[: len(keys)] = [colormap[keys[i]] for i in order]
+
+        # Find the class candidate of each pixel.
+        values_data = numpy.ma.getdata(dat)
+        span = values[-1] - values[0]
+        if numpy.all(numpy.mod(values, 1) == 0) and span <= const.DENSE_COLORMAP_SPAN:
+            # Dense lookup for integer classes.
+            dense = numpy.full(int(span) + 1, len(keys) - 1, dtype="intp")
+            dense[(values - values[0]).astype("intp")] = numpy.arange(len(keys))
+            with numpy.errstate(invalid="ignore"):
+                index = values_data.astype("intp")
+            index -= int(values[0])
+            numpy.clip(index, 0, int(span), out=index)
+            index = dense.take(index)
+        else:
+            index = numpy.searchsorted(values, values_data)
+            numpy.minimum(index, len(keys) - 1, out=index)
+        # Only keep exact matches.
+        match = values[index] == values_data
+        # If masked, use mask to filter values additional to formula values.
+        if numpy.ma.is_masked(dat):
+            match &= numpy.logical_not(dat.mask)
+        index[numpy.logical_not(match)] = len(keys)
 
-        # Replace matched rows with colors.
-        for key, color in colormap.items():
-            orig_key = key
-            # Try to use the key as number directly.
-            key = float(key)
-            selector = dat == key
-            # If masked, use mask to filter values additional to formula values.
-            if numpy.ma.is_masked(selector):
-                selector.fill_value = False
-                rgba[selector.filled() == 1] = color
-                # Compress for getting statistics.
-                selector = selector.compressed()
-            else:
-                rgba[selector] = color
+        rgba = lut.take(index, axis=0)
 
-            # Track pixel statistics for this tile.
-            stats[orig_key] = int(numpy.sum(selector))
+        # Track pixel statistics for this tile.
+        counts = numpy.bincount(index, minlength=len(keys) + 1)
+        stats.update(zip((keys[i] for i in order), counts[:-1].tolist()))
+        stats = {key: stats[key] for key in keys}
 
     # Reshape array to image size.
     rgba = rgba.reshape(data.shape[0], data.shape[1], 4)
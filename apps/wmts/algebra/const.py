@@ -2,10 +2,37 @@
 Define all mappings between operators and string representations.
 """
 import numpy
+from wmts.algebra.temporal import TEMPORAL_FUNCTION_MAP
 
 ALGEBRA_PIXEL_TYPE_GDAL = 7
 ALGEBRA_PIXEL_TYPE_NUMPY = numpy.float64
 
+# Pixel types available for formula evaluation.
+ALGEBRA_PIXEL_TYPES = {
+    "float32": numpy.float32,
+    "float64": numpy.float64,
+}
+
+# Maximum number of compiled formulas kept in memory per process.
+FORMULA_CACHE_SIZE = 256
+
+# Number of color levels in lookup tables for continuous colormaps and the
+# maximum number of tables kept in memory per process.
+COLORMAP_LUT_SIZE = 1024
+COLORMAP_CACHE_SIZE = 64
+
+# Maximum value span of integer classes in discrete colormaps for which a
+# dense lookup is used instead of a binary search.
+DENSE_COLORMAP_SPAN = 65535
+
+# Formula evaluation engines.
+STACK_ENGINE = "stack"
+REGISTER_ENGINE = "register"
+
+# Hand pure arithmetic formulas to numexpr if it is installed. Only pays off
+# with several cores, for single tiles on one core numpy is faster.
+ALGEBRA_USE_NUMEXPR = False
+
 LPAR = "("
 RPAR = ")"
 
@@ -31,6 +58,9 @@ KEYWORD_MAP = {
     INFINITE: numpy.inf,
 }
 
+# Keywords that represent numbers and can be folded into constants.
+NUMERIC_KEYWORDS = (EULER, PI)
+
 # Operator strings
 ADD = "+"
 SUBTRACT = "-"
@@ -122,3 +152,46 @@ FUNCTION_MAP = {
     "std": numpy.std,
     "sum": numpy.sum,
 }
+
+# Functions reducing the time axis of formulas over several dates.
+TEMPORAL_FUNCTIONS = tuple(TEMPORAL_FUNCTION_MAP)
+FUNCTION_MAP.update(TEMPORAL_FUNCTION_MAP)
+
+# Operators with floating point results, these are evaluated into reusable
+# scratch buffers by the register engine.
+INPLACE_OPERATORS = (
+    ADD,
+    SUBTRACT,
+    MULTIPLY,
+    DIVIDE,
+    POWER,
+    UNARY_LESS,
+    "sin",
+    "cos",
+    "tan",
+    "log",
+    "exp",
+    "abs",
+    "sign",
+)
+
+# Map pure arithmetic operators and functions to numexpr syntax.
+NUMEXPR_OPERATOR_MAP = {
+    ADD: "+",
+    SUBTRACT: "-",
+    MULTIPLY: "*",
+    DIVIDE: "/",
+    POWER: "**",
+}
+
+NUMEXPR_UNARY_OPERATOR_MAP = {
+    UNARY_AND: "+",
+    UNARY_LESS: "-",
+}
+
+NUMEXPR_KEYWORD_MAP = {
+    EULER: repr(numpy.e),
+    PI: repr(numpy.pi),
+}
+
+NUMEXPR_FUNCTIONS = ("sin", "cos", "tan", "log", "exp", "abs")
@@ -0,0 +1,358 @@
+"""
+Compilation and register based evaluation of raster algebra formulas.
+
+The postfix program of a formula is translated once into a linear list of
+instructions operating on a small set of registers. Each register owns a
+scratch buffer that is allocated on first use and then reused through the
+numpy `out=` arguments, so the number of full size temporaries is bounded by
+the number of registers and not by the number of operators in the formula.
+"""
+import re
+from collections import namedtuple
+
+import numpy
+from wmts.algebra import const
+from wmts.algebra.exceptions import RasterAlgebraException
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Operand kinds of the register program.
+REGISTER = "register"
+VARIABLE = "variable"
+CONSTANT = "constant"
+
+NUMBER_REGEX = re.compile(const.NUMBER)
+
+
+class Instruction(namedtuple("Instruction", ["op", "func", "args", "target"])):
+    """
+    Single operation of a register program.
+
+    The arguments are (kind, value) operand tuples, the result is stored in
+    the target register.
+    """
+
+    __slots__ = ()
+
+
+def get_operation(token):
+    """
+    Get the function and the number of arguments of an operator token.
+
+    Returns None for operands, which are variables, keywords and numbers.
+    """
+    if token in const.UNARY_OPERATOR_MAP:
+        return const.UNARY_OPERATOR_MAP[token], 1
+    elif token in const.OPERATOR_MAP:
+        return const.OPERATOR_MAP[token], 2
+    elif token in const.FUNCTION_MAP:
+        return const.FUNCTION_MAP[token], 1
+
+
+def fold_constants(postfix):
+    """
+    Evaluate all constant subexpressions of a postfix program.
+
+    Subexpressions that only depend on numbers and the numeric keywords are
+    replaced by a single number, as long as the result is a finite floating
+    point number.
+    """
+    # Each stack element holds the postfix tokens of a subexpression and its
+    # value if the subexpression is constant.
+    stack = []
+    for token in postfix:
+        operation = get_operation(token)
+        if operation is None:
+            if token in const.NUMERIC_KEYWORDS:
+                value = numpy.array(
+                    const.KEYWORD_MAP[token], dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY
+                )
+            elif NUMBER_REGEX.fullmatch(token):
+                value = numpy.array(token, dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY)
+            else:
+                value = None
+            stack.append(((token,), value))
+            continue
+
+        func, arity = operation
+        # Leave incomplete programs to the evaluation.
+        if len(stack) < arity:
+            return tuple(postfix)
+        args = stack[-arity:]
+        del stack[-arity:]
+        tokens = sum((arg[0] for arg in args), ()) + (token,)
+        value = None
+        # Temporal functions require the time axis of the data.
+        if token not in const.TEMPORAL_FUNCTIONS and all(
+            arg[1] is not None for arg in args
+        ):
+            with numpy.errstate(all="ignore"):
+                result = func(*(arg[1] for arg in args))
+            # Only fold floating point results, booleans and integers behave
+            # differently in the operators that follow.
+            if (
+                numpy.ndim(result) == 0
+                and numpy.asarray(result).dtype.kind == "f"
+                and numpy.isfinite(result)
+            ):
+                value = numpy.array(result, dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY)
+                tokens = (repr(float(value)),)
+        stack.append((tokens, value))
+
+    return tuple(token for tokens, value in stack for token in tokens)
+
+
+def null_mask(data, operator):
+    """
+    Get the mask of the data to compare it against NULL.
+    """
+    # Make sure the right operator is used
+    if operator not in (const.EQUAL, const.NOT_EQUAL):
+        raise RasterAlgebraException(
+            'NULL can only be used with "==" or "!=" operators.'
+        )
+    # Get mask
+    if numpy.ma.is_masked(data):
+        return data.mask
+    # If there is no mask, all values are not null
+    return numpy.zeros(data.shape, dtype=numpy.bool)
+
+
+def inplace_shape(args):
+    """
+    Get the shape of the output buffer for the operator arguments.
+
+    Returns None if the result can not be safely written into a scratch
+    buffer, which is the case for masked data or broadcasting arrays.
+    """
+    arrays = [arg for arg in args if isinstance(arg, numpy.ndarray) and arg.ndim]
+    if not arrays:
+        return
+    shape = arrays[0].shape
+    for arr in arrays:
+        if isinstance(arr, numpy.ma.MaskedArray) or arr.shape != shape:
+            return
+    return shape
+
+
+class RegisterProgram(object):
+    """
+    Linear register program compiled from a postfix expression stack.
+
+    Example usage::
+
+        >>> program = RegisterProgram(("a", "b", "-", "a", "b", "+", "/"))
+        >>> program.registers
+        ... 2
+        >>> program.evaluate({"a": numpy.array([3.0]), "b": numpy.array([1.0])})
+        ... array([0.5])
+    """
+
+    def __init__(self, postfix):
+        """
+        Translate the postfix program into register instructions.
+
+        The postfix program is first converted to a graph in which identical
+        subexpressions share a single node, so that they are evaluated only
+        once. Registers are released after the last use of their value.
+        """
+        self.instructions = []
+        self.variables = set()
+        self.registers = 0
+        self.expression = None
+
+        # Operands of variables and constants by node key.
+        leaves = {}
+        # Operator nodes by key, in evaluation order.
+        nodes = {}
+        # Infix expressions for numexpr, None as soon as the formula contains
+        # an operator numexpr can not handle.
+        infix = {}
+
+        stack = []
+        for token in postfix:
+            operation = get_operation(token)
+            if operation is None:
+                # Load operands directly from the input data or constants.
+                if token in const.KEYWORD_MAP:
+                    key = (CONSTANT, token)
+                    leaves[key] = (CONSTANT, const.KEYWORD_MAP[token])
+                    infix[key] = const.NUMEXPR_KEYWORD_MAP.get(token)
+                elif NUMBER_REGEX.fullmatch(token):
+                    key = (CONSTANT, token)
+                    leaves[key] = (
+                        CONSTANT,
+                        numpy.array(token, dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY),
+                    )
+                    infix[key] = repr(float(token))
+                else:
+                    key = (VARIABLE, token)
+                    leaves[key] = key
+                    infix[key] = token if token.isidentifier() else None
+                stack.append(key)
+                continue
+
+            func, arity = operation
+            if len(stack) < arity:
+                raise RasterAlgebraException(
+                    'Missing arguments for "{}" in formula.'.format(token)
+                )
+            children = tuple(stack[-arity:])
+            del stack[-arity:]
+            # Identical subexpressions have identical keys.
+            key = (token,) + children
+            if key not in nodes:
+                nodes[key] = (token, func, children)
+                infix[key] = self.infix(token, [infix[child] for child in children])
+            stack.append(key)
+
+        if not stack:
+            raise RasterAlgebraException("Formula is empty.")
+        root = stack.pop()
+
+        # Count the uses of each operator node reachable from the result.
+        uses = {root: 1}
+        for key in reversed(list(nodes)):
+            if key not in uses:
+                continue
+            for child in nodes[key][2]:
+                if child in nodes:
+                    uses[child] = uses.get(child, 0) + 1
+
+        free = []
+        registers = {}
+        for key, (token, func, children) in nodes.items():
+            if key not in uses:
+                continue
+
+            args = []
+            released = []
+            for child in children:
+                if child in nodes:
+                    args.append((REGISTER, registers[child]))
+                    uses[child] -= 1
+                    if not uses[child]:
+                        released.append(registers.pop(child))
+                else:
+                    args.append(leaves[child])
+                    if child[0] == VARIABLE:
+                        self.variables.add(child[1])
+
+            # Write into the register of an argument that is not used anymore,
+            # otherwise use the lowest free register or open a new one.
+            if released:
+                target = released[0]
+                free.extend(released[1:])
+            elif free:
+                target = free.pop(free.index(min(free)))
+            else:
+                target = self.registers
+                self.registers += 1
+
+            registers[key] = target
+            self.instructions.append(Instruction(token, func, tuple(args), target))
+
+        if root in nodes:
+            self.result = (REGISTER, registers[root])
+            self.expression = infix[root]
+        else:
+            self.result = leaves[root]
+            if root[0] == VARIABLE:
+                self.variables.add(root[1])
+
+        # The variables the program depends on.
+        self.variables = frozenset(self.variables)
+
+    @staticmethod
+    def infix(op, exprs):
+        """
+        Convert an operator and its argument expressions to a numexpr string.
+        """
+        if any(expr is None for expr in exprs):
+            return
+        if op in const.NUMEXPR_OPERATOR_MAP:
+            return "({} {} {})".format(
+                exprs[0], const.NUMEXPR_OPERATOR_MAP[op], exprs[1]
+            )
+        elif op in const.NUMEXPR_UNARY_OPERATOR_MAP:
+            return "({}{})".format(const.NUMEXPR_UNARY_OPERATOR_MAP[op], exprs[0])
+        elif op in const.NUMEXPR_FUNCTIONS:
+            return "{}({})".format(op, exprs[0])
+
+    def load(self, operand, data, values):
+        """
+        Get the value of an operand.
+        """
+        kind, value = operand
+        if kind == REGISTER:
+            return values[value]
+        elif kind == VARIABLE:
+            try:
+                return data[value]
+            except KeyError:
+                raise RasterAlgebraException(
+                    'Found an undeclared variable "{0}" in formula.'.format(value)
+                )
+        return value
+
+    def evaluate(self, data, use_numexpr=const.ALGEBRA_USE_NUMEXPR):
+        """
+        Evaluate the program on the input data.
+
+        If requested, pure arithmetic programs are handed to numexpr if it is
+        installed and the input data is not masked.
+        """
+        if (
+            use_numexpr
+            and numexpr is not None
+            and self.expression is not None
+            and self.variables.issubset(data)
+            and not any(
+                isinstance(data[var], numpy.ma.MaskedArray) for var in self.variables
+            )
+        ):
+            return numexpr.evaluate(
+                self.expression, local_dict={var: data[var] for var in self.variables}
+            )
+
+        values = [None] * self.registers
+        buffers = [None] * self.registers
+
+        for instruction in self.instructions:
+            args = [self.load(arg, data, values) for arg in instruction.args]
+            # Handle null case
+            if instruction.op in const.OPERATOR_MAP:
+                if isinstance(args[0], str) and args[0] == const.NULL:
+                    args = [True, null_mask(args[1], instruction.op)]
+                elif isinstance(args[1], str) and args[1] == const.NULL:
+                    args = [null_mask(args[0], instruction.op), True]
+
+            shape = (
+                inplace_shape(args)
+                if instruction.op in const.INPLACE_OPERATORS
+                else None
+            )
+            if shape is not None:
+                dtype = numpy.result_type(*args)
+                shape = shape if dtype.kind == "f" else None
+
+            if shape is None:
+                result = instruction.func(*args)
+                # Functions may return their input, make sure that no other
+                # register refers to the scratch buffer of a register.
+                if any(result is buffer for buffer in buffers):
+                    result = result.copy()
+                values[instruction.target] = result
+                continue
+
+            # Reuse the scratch buffer of the target register.
+            buffer = buffers[instruction.target]
+            if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+                buffer = numpy.empty(shape, dtype=dtype)
+                buffers[instruction.target] = buffer
+            values[instruction.target] = instruction.func(*args, out=buffer)
+
+        return self.load(self.result, data, values)
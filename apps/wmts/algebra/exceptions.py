@@ -0,0 +1,2 @@
+class RasterAlgebraException(Exception):
+    pass
@@ -1,6 +1,7 @@
 import keyword
 import operator
-from functools import reduce
+from collections import namedtuple
+from functools import lru_cache, reduce
 
 import numpy
 from pyparsing import (
@@ -8,6 +9,7 @@ from pyparsing import (
     Keyword,
     Literal,
     Optional,
+    ParseException,
     Regex,
     Word,
     ZeroOrMore,
@@ -16,10 +18,8 @@ from pyparsing import (
     oneOf,
 )
 from wmts.algebra import const
-
-
-class RasterAlgebraException(Exception):
-    pass
+from wmts.algebra.engine import RegisterProgram, fold_constants, null_mask
+from wmts.algebra.exceptions import RasterAlgebraException
 
 
 class FormulaParser(object):
@@ -50,13 +50,30 @@ class FormulaParser(object):
 
     def __init__(self):
         """
-        Set up the Backus Normal Form (BNF) parser logic.
+        Set an empty formula, the grammar is only built once it is required.
         """
         # Set an empty formula attribute
         self.formula = None
 
+        # The BNF grammar is built lazily, evaluating a formula that was
+        # compiled before does not require the grammar at all.
+        self._bnf = None
+
+    @property
+    def bnf(self):
+        """
+        Backus Normal Form (BNF) grammar of the parser.
+        """
+        if self._bnf is None:
+            self._bnf = self.build_bnf()
+        return self._bnf
+
+    def build_bnf(self):
+        """
+        Set up the Backus Normal Form (BNF) parser logic.
+        """
         # Instantiate blank parser for BNF construction
-        self.bnf = Forward()
+        bnf = Forward()
 
         # Expression for parenthesis, which are suppressed in the atoms
         # after matching.
@@ -86,14 +103,14 @@ class FormulaParser(object):
         )
 
         # Functional calls
-        function = Word(alphanums) + lpar + self.bnf + rpar
+        function = Word(alphanums) + lpar + bnf + rpar
 
         # Atom core - a single element is either a math constant,
         # a function or a variable.
         atom_core = function | pi | e | null | _true | _false | number | variable
 
         # Atom subelement between parenthesis
-        atom_subelement = lpar + self.bnf.suppress() + rpar
+        atom_subelement = lpar + bnf.suppress() + rpar
 
         # In atoms, pi and e need to be before the letters for it to be found
         atom = (
@@ -107,7 +124,9 @@ class FormulaParser(object):
         factor << atom + ZeroOrMore((powop + factor).setParseAction(self.push_first))
 
         term = factor + ZeroOrMore((multop + factor).setParseAction(self.push_first))
-        self.bnf << term + ZeroOrMore((addop + term).setParseAction(self.push_first))
+        bnf << term + ZeroOrMore((addop + term).setParseAction(self.push_first))
+
+        return bnf
 
     def push_first(self, strg, loc, toks):
         self.expr_stack.append(toks[0])
@@ -159,25 +178,38 @@ class FormulaParser(object):
 
     @staticmethod
     def get_mask(data, operator):
-        # Make sure the right operator is used
-        if operator not in (const.EQUAL, const.NOT_EQUAL):
-            raise RasterAlgebraException(
-                'NULL can only be used with "==" or "!=" operators.'
-            )
-        # Get mask
-        if numpy.ma.is_masked(data):
-            return data.mask
-        # If there is no mask, all values are not null
-        return numpy.zeros(data.shape, dtype=numpy.bool)
+        return null_mask(data, operator)
 
     def set_formula(self, formula):
         """
         Store the input formula as the one to evaluate on.
         """
-        # Remove any white space and line breaks from formula.
-        self.formula = formula.replace(" ", "").replace("\n", "").replace("\r", "")
+        self.formula = normalize_formula(formula)
 
-    def prepare_data(self):
+    def parse(self, formula=None):
+        """
+        Parse the formula into its postfix expression stack.
+        """
+        if formula:
+            self.set_formula(formula)
+
+        if not self.formula:
+            raise RasterAlgebraException("Formula not specified.")
+
+        # Reset expression stack
+        self.expr_stack = []
+
+        # Populate the expression stack
+        try:
+            self.bnf.parseString(self.formula, parseAll=True)
+        except ParseException as e:
+            raise RasterAlgebraException(
+                'Could not parse formula "{}": {}'.format(self.formula, e)
+            )
+
+        return tuple(self.expr_stack)
+
+    def prepare_data(self, dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY):
         """
         Basic checks and conversion of input data.
         """
@@ -195,17 +227,24 @@ class FormulaParser(object):
             if not isinstance(var, numpy.ndarray):
                 with var.open() as rst:
                     self.variable_map[key] = rst.read().ravel()
-            # Ensure all input data in the algebra pixel type.
-            self.variable_map[key] = self.variable_map[key].astype(
-                const.ALGEBRA_PIXEL_TYPE_NUMPY
-            )
-
-    def evaluate(self, data=None, formula=None):
+            # Ensure all input data in the algebra pixel type, data that
+            # already has the pixel type is not copied.
+            self.variable_map[key] = self.variable_map[key].astype(dtype, copy=False)
+
+    def evaluate(
+        self,
+        data=None,
+        formula=None,
+        engine=const.STACK_ENGINE,
+        dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY,
+    ):
         """
         Evaluate the input data using the current formula expression stack.
 
         The formula is stored as attribute and can be re-evaluated with several
-        input data sets on an existing parser.
+        input data sets on an existing parser. With the register engine, the
+        compiled register program is evaluated instead of the recursive stack
+        evaluation. The input data is converted to the given pixel type.
         """
         data = data or {}
         if formula:
@@ -218,19 +257,87 @@ class FormulaParser(object):
         self.variable_map = data
 
         # Check and convert input data
-        self.prepare_data()
+        self.prepare_data(dtype)
 
-        # Reset expression stack
-        self.expr_stack = []
+        # The formula is only parsed if it was not compiled before.
+        compiled = compile_formula(self.formula)
 
-        # Populate the expression stack
-        self.bnf.parseString(self.formula)
+        if engine == const.REGISTER_ENGINE:
+            return compiled.registers.evaluate(self.variable_map)
+        elif engine != const.STACK_ENGINE:
+            raise RasterAlgebraException('Unknown engine "{}".'.format(engine))
+
+        # Populate the expression stack from the compiled program.
+        self.expr_stack = list(compiled.program)
 
         # Evaluate stack on data
         return self.evaluate_stack(self.expr_stack)
 
 
-def evaluate(formula, bands, stack):
+class CompiledFormula(
+    namedtuple("CompiledFormula", ["formula", "program", "registers"])
+):
+    """
+    Immutable evaluation plan of a formula.
+
+    The program is the postfix expression stack of the formula as a tuple, it
+    is copied into a fresh stack for every evaluation. The registers are the
+    same program translated for the register engine.
+    """
+
+    __slots__ = ()
+
+    @property
+    def variables(self):
+        """
+        Names of the variables referenced by the formula.
+        """
+        return self.registers.variables
+
+
+def normalize_formula(formula):
+    """
+    Remove any white space and line breaks from formula.
+    """
+    return formula.replace(" ", "").replace("\n", "").replace("\r", "")
+
+
+@lru_cache(maxsize=const.FORMULA_CACHE_SIZE)
+def _compile_normalized_formula(formula):
+    program = fold_constants(FormulaParser().parse(formula))
+    return CompiledFormula(formula, program, RegisterProgram(program))
+
+
+def compile_formula(formula):
+    """
+    Compile a formula into an evaluation plan.
+
+    The plans are cached per process in a LRU cache keyed by the normalized
+    formula string. So the grammar is only built and the formula only parsed
+    once for each formula, repeated evaluations only pay for the numpy
+    operations. Constant subexpressions are folded at compile time and the
+    register program evaluates identical subexpressions only once.
+
+    Parameters
+    ----------
+    formula : str
+        A raster algebra formula.
+
+    Returns
+    -------
+    compiled : CompiledFormula
+        The normalized formula, its postfix and its register program.
+    """
+    return _compile_normalized_formula(normalize_formula(formula))
+
+
+def evaluate(
+    formula,
+    bands,
+    stack,
+    engine=const.REGISTER_ENGINE,
+    dtype=const.ALGEBRA_PIXEL_TYPE_NUMPY,
+):
     """
     Evaluate a formula based on a pixels stack and the data key lookup.
 
@@ -247,6 +354,12 @@ def evaluate(formula, bands, stack):
         A 3D pixels stack to use for evaluation. The first dimension should be
         the bands, in the same order as in the `bands` list argument. The other
         two dimensions should be the width and the height.
+    engine : str, optional
+        The evaluation engine, either "register" or "stack". The register
+        engine reuses scratch buffers and uses numexpr when installed.
+    dtype : str or numpy dtype, optional
+        The pixel type used for evaluation. Float32 halves the memory used
+        compared to the default float64.
 
     Returns
     -------
@@ -255,4 +368,4 @@ def evaluate(formula, bands, stack):
     """
     parser = FormulaParser()
     parser.set_formula(formula)
-    return parser.evaluate(dict(zip(bands, stack)))
+    return parser.evaluate(dict(zip(bands, stack)), engine=engine, dtype=dtype)
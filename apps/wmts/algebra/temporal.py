@@ -0,0 +1,64 @@
+"""
+Temporal functions of the raster algebra.
+
+Formulas over several dates evaluate on (time, height, width) stacks, with
+the per-pixel operators vectorized over all dates at once. The temporal
+functions reduce the time axis to a single (height, width) image. Dates
+without data are NaN and ignored by the reductions.
+"""
+import warnings
+
+import numpy
+
+
+def nan_reduction(func):
+    """
+    Wrap a NaN aware numpy reduction to reduce along the time axis.
+
+    Pixels without data on all dates are NaN in the result, or zero for sums.
+    """
+
+    def reduce(data):
+        with warnings.catch_warnings():
+            # Pixels without data on all dates are expected.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return func(data, axis=0)
+
+    reduce.__name__ = func.__name__
+    return reduce
+
+
+def first_valid(data):
+    """
+    Get the value of the first date with data of each pixel.
+    """
+    valid = ~numpy.isnan(data)
+    index = numpy.argmax(valid, axis=0)
+    return numpy.take_along_axis(data, index[numpy.newaxis], axis=0)[0]
+
+
+def last_valid(data):
+    """
+    Get the value of the last date with data of each pixel.
+    """
+    return first_valid(data[::-1])
+
+
+def difference(data):
+    """
+    Get the change from the first to the last date with data of each pixel.
+    """
+    return last_valid(data) - first_valid(data)
+
+
+TEMPORAL_FUNCTION_MAP = {
+    "tmean": nan_reduction(numpy.nanmean),
+    "tmedian": nan_reduction(numpy.nanmedian),
+    "tmin": nan_reduction(numpy.nanmin),
+    "tmax": nan_reduction(numpy.nanmax),
+    "tstd": nan_reduction(numpy.nanstd),
+    "tsum": nan_reduction(numpy.nansum),
+    "tfirst": first_valid,
+    "tlast": last_valid,
+    "tdiff": difference,
+}
@@ -0,0 +1,283 @@
+"""
+Server side cache for rendered tiles.
+
+The backend is configured through the WMTS_TILE_CACHE setting, which holds the
+import path of the backend class and its options.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from wmts import const
+
+
+class BaseTileCache(object):
+    """
+    Tile cache interface, this base implementation does not cache anything.
+
+    Backends that support it can lock keys across workers while a tile is
+    rendered, if a lock timeout is set.
+    """
+
+    lock_timeout = None
+
+    def get(self, key):
+        """
+        Get the tile data for a cache key, None if the tile is not cached.
+        """
+        return
+
+    def set(self, key, data):
+        """
+        Store the tile data under a cache key.
+        """
+        pass
+
+    def acquire(self, key):
+        """
+        Try to acquire the lock for a cache key, without waiting.
+        """
+        return True
+
+    def release(self, key):
+        """
+        Release the lock for a cache key.
+        """
+        pass
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Lock a cache key across workers.
+
+        Waits until the lock is acquired or the lock timeout has passed. After
+        a timeout the block is executed without the lock, so a crashed worker
+        can not block a tile forever.
+        """
+        if not self.lock_timeout:
+            yield
+            return
+        deadline = time.monotonic() + self.lock_timeout
+        acquired = self.acquire(key)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(const.TILE_LOCK_POLL_INTERVAL)
+            acquired = self.acquire(key)
+        try:
+            yield
+        finally:
+            if acquired:
+                self.release(key)
+
+
+class DiskTileCache(BaseTileCache):
+    """
+    Tile cache on a local or shared file system with LRU eviction.
+
+    Tiles are stored as one file per key. Reading a tile updates its
+    modification time, so that once the cache exceeds its maximum size, the
+    least recently used tiles are evicted first.
+
+    Each worker counts the size of its own writes, and counts the files again
+    in intervals, so that the size includes the tiles of workers sharing the
+    path.
+    """
+
+    def __init__(
+        self, path, max_size=256 * 1024**2, cull_fraction=0.2, lock_timeout=None
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.cull_fraction = cull_fraction
+        self.lock_timeout = lock_timeout
+        # The cache size is determined from the files on first write. It is
+        # updated by concurrent writers, such as the threads of seedtiles.
+        self.size = None
+        self.size_lock = threading.Lock()
+        self.scanned = None
+
+    def get_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as fl:
+                data = fl.read()
+            # Mark tile as recently used.
+            os.utime(path)
+        except OSError:
+            return
+        return data
+
+    def set(self, key, data):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so that concurrent readers never
+        # see partially written tiles.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        with os.fdopen(fd, "wb") as fl:
+            fl.write(data)
+        os.replace(tmp, path)
+
+        with self.size_lock:
+            now = time.monotonic()
+            if self.size is None or now - self.scanned > const.TILE_CACHE_SCAN_INTERVAL:
+                self.size = sum(entry[2] for entry in self.entries())
+                self.scanned = now
+            else:
+                self.size += len(data)
+            if self.size > self.max_size:
+                self.cull()
+
+    def get_lock_path(self, key):
+        # Lock files are hidden, so that they are never culled.
+        return os.path.join(self.path, key[:2], ".{}.lock".format(key))
+
+    def acquire(self, key):
+        path = self.get_lock_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # Remove stale locks of workers that did not release them.
+            try:
+                if time.time() - os.path.getmtime(path) > self.lock_timeout:
+                    os.remove(path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def release(self, key):
+        try:
+            os.remove(self.get_lock_path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        List path, modification time and size of all cached tiles.
+        """
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                # Skip temporary files of tiles being written.
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def cull(self):
+        """
+        Remove least recently used tiles until the cache is below its limit.
+
+        Called with the size lock held, so that only one writer culls.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum(entry[2] for entry in entries)
+        self.scanned = time.monotonic()
+        target = self.max_size * (1 - self.cull_fraction)
+        for path, mtime, size in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+class DjangoTileCache(BaseTileCache):
+    """
+    Tile cache using one of the caches configured in the CACHES setting.
+
+    This allows sharing tiles between workers through a memcached or redis
+    backend, the eviction is handled by the cache backend.
+    """
+
+    def __init__(self, alias="default", timeout=None, lock_timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, data):
+        caches[self.alias].set(key, data, timeout=self.timeout)
+
+    def acquire(self, key):
+        # Adding a key is atomic in the memcached and redis backends.
+        return caches[self.alias].add(
+            "lock-{}".format(key), True, timeout=self.lock_timeout
+        )
+
+    def release(self, key):
+        caches[self.alias].delete("lock-{}".format(key))
+
+
+@lru_cache(maxsize=None)
+def get_tile_cache():
+    """
+    Get the tile cache configured in the settings.
+    """
+    config = getattr(settings, "WMTS_TILE_CACHE", {})
+    backend = import_string(config.get("BACKEND", "wmts.cache.BaseTileCache"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+def tile_cache_key(z, x, y, **params):
+    """
+    Compute the cache key for a tile from its normalized request parameters.
+    """
+    params.update({"z": z, "x": x, "y": y})
+    data = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class SingleFlight(object):
+    """
+    Deduplicate concurrent calls with the same key within a process.
+
+    The first caller executes the function, concurrent callers with the same
+    key wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.mutex:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.mutex:
+                del self.calls[key]
@@ -0,0 +1,276 @@
+"""
+Multi-date composites for tiles.
+
+Instead of the latest valid pixel, composite tiles reduce all scenes of a date
+window to a single stack, either with a per-pixel percentile such as the
+median, or by picking the pixels of the scene with the highest NDVI. Scenes
+are read concurrently and fed into the reducer one at a time as they arrive.
+The greenest pixel reducer only keeps the best pixels so far, the percentile
+reducers keep the scenes found, bounded by a memory budget.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
+
+import numpy
+import rasterio
+import structlog
+from pixels.exceptions import PixelsException
+from rasterio.errors import RasterioError
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from wmts import const, search, timing
+
+logger = structlog.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_scene_executor():
+    """
+    Get the thread pool for scene reads, shared by all requests of a worker.
+    """
+    return ThreadPoolExecutor(max_workers=const.COMPOSITE_WORKERS)
+
+
+class PercentileReducer(object):
+    """
+    Reduce scenes to a per-pixel percentile of their valid values.
+
+    Pixels with value zero are nodata. Values are interpolated linearly
+    between the closest ranks, as in numpy.percentile. At most max_scenes
+    scenes are kept, later scenes are ignored.
+    """
+
+    def __init__(self, shape, percentile, max_scenes=const.COMPOSITE_MAX_SCENES):
+        self.scenes = []
+        self.count = numpy.zeros(shape, dtype="uint8")
+        self.percentile = percentile
+        self.max_scenes = max_scenes
+
+    @staticmethod
+    def get_max_scenes(shape):
+        """
+        Get the number of scenes of a shape that fit in the memory budget.
+        """
+        scene_bytes = numpy.prod(shape) * numpy.dtype("uint16").itemsize
+        return max(
+            1, min(const.COMPOSITE_MAX_SCENES, const.COMPOSITE_MAX_BYTES // scene_bytes)
+        )
+
+    def add(self, stack):
+        if len(self.scenes) >= self.max_scenes:
+            return
+        # Count the valid values and sort the nodata values behind them, the
+        # stack is modified in place.
+        nodata = stack == 0
+        self.count += ~nodata
+        stack[nodata] = numpy.iinfo(stack.dtype).max
+        self.scenes.append(stack)
+
+    def sort(self):
+        """
+        Sort the values of each pixel over the scenes.
+
+        For the few scenes of a composite, an odd-even transposition sorting
+        network of elementwise minimum and maximum operations is several times
+        faster than sorting along the scene axis.
+        """
+        scenes = self.scenes
+        buffer = numpy.empty_like(scenes[0])
+        for step in range(len(scenes)):
+            for index in range(step % 2, len(scenes) - 1, 2):
+                numpy.minimum(scenes[index], scenes[index + 1], out=buffer)
+                numpy.maximum(scenes[index], scenes[index + 1], out=scenes[index + 1])
+                scenes[index], buffer = buffer, scenes[index]
+
+    def result(self):
+        self.sort()
+        scenes = numpy.stack(self.scenes)
+        last = numpy.maximum(self.count.astype("intp") - 1, 0)
+        rank = self.percentile / 100 * last
+        low = numpy.floor(rank).astype("intp")
+        high = numpy.minimum(low + 1, last)
+        low_values = numpy.take_along_axis(scenes, low[numpy.newaxis], axis=0)[0]
+        high_values = numpy.take_along_axis(scenes, high[numpy.newaxis], axis=0)[0]
+        stack = low_values + (rank - low) * (high_values.astype("float32") - low_values)
+        stack[self.count == 0] = 0
+        return numpy.round(stack).astype("uint16")
+
+
+class GreenestReducer(object):
+    """
+    Reduce scenes to the pixels with the highest NDVI.
+
+    Only pixels that are valid in all bands are used.
+    """
+
+    def __init__(self, shape, red, nir):
+        self.stack = numpy.zeros(shape, dtype="uint16")
+        self.ndvi = numpy.full(shape[1:], -numpy.inf, dtype="float32")
+        self.red = red
+        self.nir = nir
+
+    def add(self, stack):
+        # Compute the NDVI in place of the near infrared band.
+        red = stack[self.red].astype("float32")
+        ndvi = stack[self.nir].astype("float32")
+        total = ndvi + red
+        ndvi -= red
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            ndvi /= total
+        greener = ndvi > self.ndvi
+        greener &= stack.min(axis=0) != 0
+        numpy.copyto(self.ndvi, ndvi, where=greener)
+        numpy.copyto(self.stack, stack, where=greener)
+
+    def result(self):
+        return self.stack
+
+
+def read_scene(item, bands, bounds, shape):
+    """
+    Read bands of a scene, warped to the web mercator grid of the bounds.
+
+    The search results list the band urls of each scene by band name.
+    """
+    height, width = shape
+    transform = from_bounds(*bounds, width, height)
+    stack = numpy.zeros((len(bands), height, width), dtype="uint16")
+    for band, out in zip(bands, stack):
+        with rasterio.open(item["bands"][band]) as src:
+            with WarpedVRT(
+                src,
+                crs="EPSG:3857",
+                transform=transform,
+                width=width,
+                height=height,
+                nodata=0,
+            ) as vrt:
+                out[:] = vrt.read(1)
+    return stack
+
+
+def reduce_scenes(reduce, futures):
+    """
+    Add the scenes read by futures to a reducer as they are completed.
+
+    Scenes that can not be read are skipped. Returns the number of scenes
+    added.
+    """
+    added = 0
+    for future in futures:
+        try:
+            stack = future.result()
+        except (RasterioError, OSError) as e:
+            logger.warning("composite_scene_failed", error=str(e))
+            continue
+        with timing.stage("reduce"):
+            reduce.add(stack)
+        added += 1
+    return added
+
+
+def composite_pixels(
+    geojson,
+    bounds,
+    shape,
+    start,
+    end,
+    bands,
+    platforms,
+    reducer,
+    percentile=None,
+    red=None,
+    nir=None,
+    maxcloud=100,
+    level=None,
+):
+    """
+    Compute a composite of the scenes in a date window.
+
+    Parameters
+    ----------
+    geojson : dict
+        The area to search scenes for.
+    bounds : tuple
+        The web mercator bounds of the composite.
+    shape : tuple
+        The height and width of the composite in pixels.
+    start, end : str
+        The date window of the scenes.
+    bands : list
+        The bands of the composite.
+    platforms : list
+        The platforms to search.
+    reducer : str
+        One of "median", "percentile" or "greenest".
+    percentile : float, optional
+        The percentile for the percentile reducer, from 0 to 100.
+    red, nir : str, optional
+        The red and near infrared bands for the greenest pixel reducer.
+    maxcloud : int, optional
+        Maximum cloud cover of the scenes to use.
+    level : str, optional
+        The processing level of the scenes.
+
+    Returns
+    -------
+    creation_args : dict
+        The creation arguments of the composite.
+    stack : ndarray or None
+        The composite with shape (bands, height, width), None if no scenes
+        were found.
+    """
+    if search.pixels_search_data is None:
+        raise PixelsException(
+            "Composites require the scene search of the pixels library."
+        )
+    # The greenest pixel needs the red and near infrared bands as well. The
+    # percentile reducers keep all scenes, their number is bounded by memory.
+    read_bands = list(bands)
+    limit = const.COMPOSITE_MAX_SCENES
+    if reducer == const.COMPOSITE_GREENEST:
+        read_bands += [band for band in (red, nir) if band not in read_bands]
+        reduce = GreenestReducer(
+            (len(read_bands),) + shape, read_bands.index(red), read_bands.index(nir)
+        )
+    else:
+        if reducer == const.COMPOSITE_MEDIAN:
+            percentile = 50
+        limit = PercentileReducer.get_max_scenes((len(read_bands),) + shape)
+        reduce = PercentileReducer((len(read_bands),) + shape, percentile, limit)
+
+    items = search.search_data(
+        geojson=geojson,
+        start=start,
+        end=end,
+        platforms=platforms,
+        maxcloud=maxcloud,
+        level=level,
+        limit=limit,
+    )
+    if not items:
+        return {}, None
+
+    # Read scenes concurrently, but only keep as many scenes in memory as are
+    # read in parallel.
+    executor = get_scene_executor()
+    pending = set()
+    added = 0
+    try:
+        for item in items:
+            if len(pending) >= const.COMPOSITE_WORKERS:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                added += reduce_scenes(reduce, done)
+            pending.add(executor.submit(read_scene, item, read_bands, bounds, shape))
+        added += reduce_scenes(reduce, as_completed(pending))
+    except BaseException:
+        # Do not read the remaining scenes if the composite failed.
+        for future in pending:
+            future.cancel()
+        raise
+    if not added:
+        return {}, None
+
+    with timing.stage("reduce"):
+        stack = reduce.result()[: len(bands)]
+    return {"nodata": 0}, stack
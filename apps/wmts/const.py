@@ -1,2 +1,129 @@
+import zlib
+
 PIXELS_MIN_ZOOM = 10
 TILE_SIZE = 256
+# Browser and CDN cache durations in seconds. Tiles for past dates rarely
+# change, tiles up to the current date can receive new scenes.
+TILE_MAX_AGE = 30 * 24 * 3600
+CURRENT_TILE_MAX_AGE = 3600
+CAPABILITIES_MAX_AGE = 3600
+# WMTS capabilities tile matrix set and number of cached documents.
+WMTS_MAX_ZOOM = 19
+SCALE_DENOMINATOR_ZOOM_0 = 559082264.0287178
+WMTS_CAPABILITIES_CACHE_SIZE = 128
+# PNG encoding of tiles. Filter types are the PNG scanline filters, the
+# strategies are the zlib compression strategies.
+PNG_COMPRESSION_LEVEL = 6
+PNG_FILTER = "up"
+PNG_STRATEGY = "rle"
+PNG_FILTERS = {"none": 0, "sub": 1, "up": 2}
+PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "rle": zlib.Z_RLE,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+}
+# Tile formats by file extension and default quality of the lossy formats.
+TILE_FORMATS = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg"}
+TILE_QUALITY = 80
+# Placeholder tiles for out of range tiles and tiles without data. Either the
+# placeholder images, a transparent 1x1 tile or an empty 204 response.
+PLACEHOLDER_IMAGE = "image"
+PLACEHOLDER_TRANSPARENT = "transparent"
+PLACEHOLDER_NONE = "none"
+PLACEHOLDERS = (PLACEHOLDER_IMAGE, PLACEHOLDER_TRANSPARENT, PLACEHOLDER_NONE)
+PLACEHOLDER_MAX_AGE = TILE_MAX_AGE
+# Default number of tiles along each side of metatiles.
+METATILE_SIZE = 1
+# Seconds between attempts to acquire a tile lock held by another worker.
+TILE_LOCK_POLL_INTERVAL = 0.1
+# Seconds after which the disk tile cache size is counted again from the
+# files, to include the tiles written by other workers.
+TILE_CACHE_SCAN_INTERVAL = 60
+# Shared scene searches over parent tiles return up to this many times more
+# scenes than the tile searches, and are cached for this many seconds.
+SCENE_SEARCH_LIMIT_FACTOR = 4
+SCENE_SEARCH_TIMEOUT = 3600
+# Number of tiles rendered in parallel when seeding the tile cache, and the
+# seconds between progress reports.
+SEED_WORKERS = 4
+SEED_REPORT_INTERVAL = 10
+# Below the minimum zoom for pixels, tiles are overviews downsampled from
+# their cached children, down to this zoom level.
+OVERVIEW_MIN_ZOOM = 5
+# Overviews from this zoom level on render their missing children on demand.
+# Lower overviews are only complete in areas seeded with seedtiles.
+OVERVIEW_RENDER_MIN_ZOOM = 9
+# Percentile stretch of RGB tiles, computed from the pixels of the parent tile
+# this many zoom levels above and cached for the given seconds.
+STRETCH_AUTO = "auto"
+STRETCH_MODES = (STRETCH_AUTO,)
+STRETCH_PERCENTILES = (2, 98)
+STRETCH_ZOOM_OFFSET = 3
+STRETCH_TIMEOUT = 24 * 3600
+# Platforms available for tiles, with their date range, default RGB bands, the
+# red and near infrared bands, the reflectance mapped to the top of the RGB
+# range and the processing level.
+# Platforms can be added or changed with the WMTS_PLATFORMS setting.
+PLATFORMS = {
+    "LANDSAT_4": {
+        "start": "1982-08-22",
+        "end": "1993-12-14",
+        "bands": ["B3", "B2", "B1"],
+        "red": "B3",
+        "nir": "B4",
+        "scaling": 100,
+    },
+    "LANDSAT_5": {
+        "start": "1984-03-16",
+        "end": "2013-06-05",
+        "bands": ["B3", "B2", "B1"],
+        "red": "B3",
+        "nir": "B4",
+        "scaling": 100,
+    },
+    "LANDSAT_7": {
+        "start": "1999-05-28",
+        "bands": ["B3", "B2", "B1"],
+        "red": "B3",
+        "nir": "B4",
+        "scaling": 255,
+    },
+    "LANDSAT_8": {
+        "start": "2013-04-11",
+        "bands": ["B4", "B3", "B2"],
+        "red": "B4",
+        "nir": "B5",
+        "scaling": 30000,
+    },
+    "SENTINEL_2": {
+        "start": "2015-06-27",
+        "bands": ["B04", "B03", "B02"],
+        "red": "B04",
+        "nir": "B08",
+        "scaling": 4000,
+        "level": "L2A",
+    },
+}
+# Platforms of tiles without platform, by the end dates before which they are
+# used. The last platforms are used for all later end dates.
+DEFAULT_PLATFORMS = [
+    ("2000-01-01", ["LANDSAT_4", "LANDSAT_5"]),
+    ("2014-01-01", ["LANDSAT_7"]),
+    ("2018-01-01", ["LANDSAT_8"]),
+    (None, ["SENTINEL_2"]),
+]
+# Composite tiles reduce the scenes of a date window, with up to this number
+# of scenes read in parallel per request.
+COMPOSITE_MEDIAN = "median"
+COMPOSITE_PERCENTILE = "percentile"
+COMPOSITE_GREENEST = "greenest"
+COMPOSITE_REDUCERS = (COMPOSITE_MEDIAN, COMPOSITE_PERCENTILE, COMPOSITE_GREENEST)
+COMPOSITE_MAX_SCENES = 20
+# Memory budget for the scenes kept by percentile composites, which limits the
+# number of scenes of large metatiles.
+COMPOSITE_MAX_BYTES = 64 * 1024**2
+COMPOSITE_WORKERS = 8
+# Formulas with temporal functions are evaluated over the latest pixels of up
+# to this number of end dates.
+TEMPORAL_MAX_DATES = 12
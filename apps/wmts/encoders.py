@@ -0,0 +1,213 @@
+"""
+Image encoders for tile responses.
+
+The encoders work directly on the uint8 arrays produced by the tile renderer,
+in the (bands, height, width) layout used by rasterio.
+"""
+import struct
+import warnings
+import zlib
+
+import numpy
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from wmts import const
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color types by number of bands.
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+def png_chunk(tag, data):
+    """
+    Pack a PNG chunk with its length and checksum.
+    """
+    return b"".join(
+        (
+            struct.pack(">I", len(data)),
+            tag,
+            data,
+            struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))),
+        )
+    )
+
+
+def png_scanlines(img, filter_type):
+    """
+    Interleave the image bands into filtered PNG scanlines.
+
+    Returns a (height, 1 + width * bands) array in which each row starts with
+    the filter type byte, followed by the filtered pixel values.
+    """
+    bands, height, width = img.shape
+    raw = numpy.empty((height, 1 + width * bands), dtype="uint8")
+    raw[:, 0] = const.PNG_FILTERS[filter_type]
+    # Write the pixels in place, as a view on the raw scanlines.
+    pixels = numpy.ndarray(
+        (height, width, bands),
+        dtype="uint8",
+        buffer=raw,
+        offset=1,
+        strides=(raw.strides[0], bands, 1),
+    )
+    numpy.copyto(pixels, img.transpose(1, 2, 0))
+    lines = raw[:, 1:]
+    # Filters are differences with the left or upper neighbor, wrapping
+    # around modulo 256.
+    if filter_type == "sub":
+        numpy.subtract(lines[:, bands:], lines[:, :-bands], out=lines[:, bands:])
+    elif filter_type == "up":
+        numpy.subtract(lines[1:], lines[:-1], out=lines[1:])
+    return raw
+
+
+def encode_png(
+    img,
+    compression_level=const.PNG_COMPRESSION_LEVEL,
+    filter_type=const.PNG_FILTER,
+    strategy=const.PNG_STRATEGY,
+    nodata=None,
+    out=None,
+):
+    """
+    Encode a uint8 image array as PNG.
+
+    Parameters
+    ----------
+    img : ndarray
+        The image data with shape (bands, height, width), with one to four
+        bands for gray, gray alpha, RGB and RGBA images.
+    compression_level : int, optional
+        The zlib compression level from 0 to 9.
+    filter_type : str, optional
+        The PNG filter applied to all scanlines, one of "none", "sub" or "up".
+    strategy : str, optional
+        The zlib compression strategy, one of "default", "filtered", "rle" or
+        "huffman".
+    nodata : int, optional
+        Pixel value to mark as transparent for images without alpha band.
+    out : file-like, optional
+        If given, the PNG chunks are written into this object, for instance an
+        HttpResponse, instead of being returned.
+
+    Returns
+    -------
+    png : bytes or None
+        The PNG image data, None if written to an output object.
+    """
+    img = numpy.asarray(img)
+    if img.ndim == 2:
+        img = img[numpy.newaxis]
+    bands, height, width = img.shape
+    if img.dtype != numpy.uint8 or bands not in PNG_COLOR_TYPES:
+        raise ValueError(
+            "PNG encoding requires uint8 images with one to four bands, "
+            "got {} with {} bands.".format(img.dtype, bands)
+        )
+
+    raw = png_scanlines(img, filter_type)
+    compressor = zlib.compressobj(
+        compression_level, zlib.DEFLATED, 15, 9, const.PNG_STRATEGIES[strategy]
+    )
+    chunks = [
+        PNG_SIGNATURE,
+        png_chunk(
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[bands], 0, 0, 0),
+        ),
+    ]
+    # Mark nodata pixels as transparent, as done by the GDAL PNG driver.
+    if nodata is not None and bands in (1, 3):
+        chunks.append(png_chunk(b"tRNS", struct.pack(">H", int(nodata)) * bands))
+    chunks.append(
+        png_chunk(b"IDAT", compressor.compress(memoryview(raw)) + compressor.flush())
+    )
+    chunks.append(png_chunk(b"IEND", b""))
+
+    if out is None:
+        return b"".join(chunks)
+    for chunk in chunks:
+        out.write(chunk)
+
+
+def encode_gdal(img, driver, **options):
+    """
+    Encode a uint8 image array with a GDAL driver.
+
+    The driver options are passed as creation options.
+    """
+    bands, height, width = img.shape
+    with warnings.catch_warnings():
+        # Tiles are not georeferenced.
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.io.MemoryFile() as memfile:
+            with memfile.open(
+                driver=driver,
+                width=width,
+                height=height,
+                count=bands,
+                dtype="uint8",
+                **options,
+            ) as dst:
+                dst.write(img)
+            return memfile.read()
+
+
+def encode_webp(img, quality=const.TILE_QUALITY):
+    """
+    Encode a RGB or RGBA image array as lossy WebP.
+    """
+    return encode_gdal(img, "WEBP", QUALITY=quality)
+
+
+def encode_jpeg(img, quality=const.TILE_QUALITY):
+    """
+    Encode a RGB image array as JPEG. JPEG has no transparency, so the alpha
+    band of RGBA images is dropped.
+    """
+    return encode_gdal(img[:3], "JPEG", QUALITY=quality)
+
+
+def decode(data):
+    """
+    Decode tile image data of any of the tile formats.
+
+    Returns the image array with shape (bands, height, width) and the nodata
+    value of the image.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.io.MemoryFile(data) as memfile:
+            with memfile.open() as dst:
+                return dst.read(), dst.nodata
+
+
+def encode(img, frmt="png", quality=None, nodata=None):
+    """
+    Encode a uint8 image array in one of the tile formats.
+
+    Parameters
+    ----------
+    img : ndarray
+        The image data with shape (bands, height, width).
+    frmt : str, optional
+        The tile format, one of the keys of const.TILE_FORMATS.
+    quality : int, optional
+        The quality from 1 to 100 for the lossy formats.
+    nodata : int, optional
+        Pixel value to mark as transparent in PNG images without alpha band.
+
+    Returns
+    -------
+    data : bytes
+        The encoded image data.
+    """
+    if frmt == "png":
+        return encode_png(img, nodata=nodata)
+    quality = quality or const.TILE_QUALITY
+    if frmt == "webp":
+        return encode_webp(img, quality)
+    elif frmt == "jpg":
+        return encode_jpeg(img, quality)
+    raise ValueError("Unknown tile format {}.".format(frmt))
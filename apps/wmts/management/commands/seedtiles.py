@@ -0,0 +1,224 @@
+import datetime
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import mercantile
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from wmts import const, platforms
+from wmts.cache import get_tile_cache, tile_cache_key
+from wmts.views import get_cached_tile, parse_tile_parameters
+
+
+def get_aoi_tiles(geojson, zooms):
+    """
+    Get the tiles covering the bounding boxes of the features of a GeoJSON.
+    """
+    if geojson.get("type") == "FeatureCollection":
+        features = geojson["features"]
+    else:
+        features = [geojson]
+    tiles = set()
+    for feature in features:
+        tiles.update(mercantile.tiles(*mercantile.geojson_bounds(feature), zooms))
+    # Overviews are rendered from their children, which are seeded as well.
+    for zoom in range(min(zooms), const.PIXELS_MIN_ZOOM):
+        for tile in [tile for tile in tiles if tile.z == zoom]:
+            tiles.update(mercantile.children(tile))
+    # Neighboring tiles are rendered together in metatiles.
+    return sorted(tiles, key=lambda tile: (tile.z, tile.y, tile.x))
+
+
+def seed_tile(key, tile, params):
+    """
+    Render a tile into the tile cache, if it is not cached yet.
+    """
+    if get_tile_cache().get(key) is not None:
+        return "cached"
+    data = get_cached_tile(tile.z, tile.x, tile.y, params)
+    return "empty" if data is None else "rendered"
+
+
+class Command(BaseCommand):
+    help = "Render the tiles of an area of interest into the tile cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "geojson", help="Path to a GeoJSON file with the area of interest."
+        )
+        parser.add_argument(
+            "--zoom",
+            type=int,
+            nargs=2,
+            metavar=("MIN", "MAX"),
+            required=True,
+            help="Range of zoom levels to render. Overviews below zoom {} are "
+            "only rendered from seeded tiles, their children are seeded "
+            "down to the pixel tiles.".format(const.OVERVIEW_RENDER_MIN_ZOOM),
+        )
+        parser.add_argument(
+            "--end",
+            action="append",
+            help="End date of the latest pixel tiles, can be repeated.",
+        )
+        parser.add_argument(
+            "--dates", help="Comma separated dates of temporal formulas."
+        )
+        parser.add_argument("--platform", default="")
+        parser.add_argument("--formula")
+        parser.add_argument("--bands", help="Comma separated list of bands.")
+        parser.add_argument("--max-cloud-cover-percentage", type=int, default=100)
+        parser.add_argument("--pixel-type")
+        parser.add_argument("--stretch", choices=const.STRETCH_MODES)
+        parser.add_argument("--vmin", help="Comma separated stretch minimum.")
+        parser.add_argument("--vmax", help="Comma separated stretch maximum.")
+        parser.add_argument("--gamma", help="Comma separated gamma correction.")
+        parser.add_argument("--composite", choices=const.COMPOSITE_REDUCERS)
+        parser.add_argument("--start", help="Start date of composites.")
+        parser.add_argument("--percentile", help="Percentile of composites.")
+        parser.add_argument(
+            "--format", dest="frmt", default="png", choices=list(const.TILE_FORMATS)
+        )
+        parser.add_argument("--quality", type=int)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=const.SEED_WORKERS,
+            help="Number of tiles rendered in parallel.",
+        )
+        parser.add_argument(
+            "--progress",
+            help="Path to a file recording the finished tiles. Tiles in this "
+            "file are skipped, so that interrupted runs can be resumed.",
+        )
+
+    def handle(self, *args, **options):
+        # Get tiles of the area of interest.
+        zmin, zmax = options["zoom"]
+        if zmin < const.OVERVIEW_MIN_ZOOM or zmax < zmin:
+            raise CommandError(
+                "Zoom levels must be at least {}.".format(const.OVERVIEW_MIN_ZOOM)
+            )
+        if options["platform"] and not platforms.is_platform(options["platform"]):
+            raise CommandError("Unknown platform {}.".format(options["platform"]))
+        with open(options["geojson"]) as fl:
+            tiles = get_aoi_tiles(json.load(fl), list(range(zmin, zmax + 1)))
+
+        # Get the rendering parameters, as for the tiles endpoint.
+        query = {
+            "max_cloud_cover_percentage": options["max_cloud_cover_percentage"],
+        }
+        for name in (
+            "formula",
+            "bands",
+            "pixel_type",
+            "quality",
+            "stretch",
+            "vmin",
+            "vmax",
+            "gamma",
+            "composite",
+            "start",
+            "percentile",
+            "dates",
+        ):
+            if options[name] is not None:
+                query[name] = options[name]
+        today = str(datetime.datetime.now().date())
+        jobs = []
+        # The end date of temporal formulas is the last of their dates.
+        ends = [None] if options["dates"] else options["end"]
+        if not ends:
+            raise CommandError("End dates or the dates of a formula are required.")
+        for end in ends:
+            try:
+                params = parse_tile_parameters(
+                    dict(query, end=end) if end else query,
+                    options["platform"],
+                    options["frmt"],
+                )
+            except ValidationError as e:
+                raise CommandError(e.detail)
+            if params["end"] >= today:
+                raise CommandError(
+                    "Only tiles of past dates are cached, got end date {}.".format(
+                        params["end"]
+                    )
+                )
+            jobs.extend(
+                (tile_cache_key(tile.z, tile.x, tile.y, **params), tile, params)
+                for tile in tiles
+            )
+
+        # Skip tiles that were finished in a previous run.
+        finished = set()
+        if options["progress"] and os.path.exists(options["progress"]):
+            with open(options["progress"]) as fl:
+                finished = set(fl.read().split())
+        jobs = [job for job in jobs if job[0] not in finished]
+        self.stdout.write(
+            "Seeding {} tiles, {} already finished.".format(len(jobs), len(finished))
+        )
+
+        counts = Counter()
+        self.start = self.last_report = time.monotonic()
+        progress = open(options["progress"], "a") if options["progress"] else None
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                # Levels are seeded from the bottom up, so that overviews find
+                # their children in the cache.
+                for zoom in sorted(
+                    {tile.z for key, tile, params in jobs}, reverse=True
+                ):
+                    level = [job for job in jobs if job[1].z == zoom]
+                    self.seed_level(executor, level, counts, progress, len(jobs))
+        finally:
+            if progress:
+                progress.close()
+
+        self.report(counts, len(jobs), time.monotonic() - self.start)
+
+    def seed_level(self, executor, jobs, counts, progress, total):
+        """
+        Seed the tiles of one zoom level in parallel.
+        """
+        futures = {
+            executor.submit(seed_tile, key, tile, params): (key, tile)
+            for key, tile, params in jobs
+        }
+        for future in as_completed(futures):
+            key, tile = futures[future]
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                self.stderr.write("Tile {} failed: {}".format(tile, e))
+                continue
+            if progress:
+                progress.write(key + "\n")
+                progress.flush()
+            # Report throughput regularly.
+            now = time.monotonic()
+            if now - self.last_report > const.SEED_REPORT_INTERVAL:
+                self.last_report = now
+                self.report(counts, total, now - self.start)
+
+    def report(self, counts, total, elapsed):
+        done = sum(counts.values())
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(
+            "{}/{} tiles in {:.0f}s, {:.1f} tiles/s ({} rendered, {} cached, "
+            "{} empty, {} failed).".format(
+                done,
+                total,
+                elapsed,
+                rate,
+                counts["rendered"],
+                counts["cached"],
+                counts["empty"],
+                counts["failed"],
+            )
+        )
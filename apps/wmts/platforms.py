@@ -0,0 +1,97 @@
+"""
+Registry of the platforms available for tiles.
+
+Each platform is described by its date range, default RGB bands, scaling and
+processing level in const.PLATFORMS, which can be extended through the
+WMTS_PLATFORMS setting. The registry is compiled into lookup tables on first
+use, from which tile rendering, capabilities and parameter validation resolve
+platforms.
+"""
+import bisect
+from functools import lru_cache
+
+from django.conf import settings
+from wmts import const
+
+# Keys required in the description of a platform.
+PLATFORM_KEYS = ("start", "bands", "scaling")
+
+
+def normalize_platform(platform):
+    """
+    Convert a platform from urls, such as "sentinel-2", to its registry name.
+    """
+    return platform.upper().replace("-", "_")
+
+
+@lru_cache(maxsize=None)
+def get_registry():
+    """
+    Compile the platform registry.
+
+    Returns the platforms by name, and the end dates and platforms of the
+    default platforms sorted for bisection.
+    """
+    platforms = {name: dict(config) for name, config in const.PLATFORMS.items()}
+    for name, config in getattr(settings, "WMTS_PLATFORMS", {}).items():
+        platforms.setdefault(normalize_platform(name), {}).update(config)
+    for name, config in platforms.items():
+        missing = [key for key in PLATFORM_KEYS if key not in config]
+        if missing:
+            raise ValueError(
+                "Platform {} is missing the keys {}.".format(name, ", ".join(missing))
+            )
+    dates = [end for end, names in const.DEFAULT_PLATFORMS[:-1]]
+    defaults = [names for end, names in const.DEFAULT_PLATFORMS]
+    return platforms, dates, defaults
+
+
+def get_platforms():
+    """
+    Get the descriptions of all platforms by name.
+    """
+    return get_registry()[0]
+
+
+def is_platform(platform):
+    """
+    Check if a platform is in the registry.
+    """
+    return normalize_platform(platform) in get_platforms()
+
+
+def resolve_platform(platform, end):
+    """
+    Get the rendering configuration for a platform.
+
+    If no platform is given, the default platforms for the end date are used.
+    Returns a dict with the list of platforms to search and the default bands,
+    red and near infrared bands, scaling and level of the first of them.
+    """
+    platforms, dates, defaults = get_registry()
+    if platform:
+        names = [normalize_platform(platform)]
+    else:
+        names = defaults[bisect.bisect_right(dates, end)]
+    config = platforms[names[0]]
+    return {
+        "platforms": names,
+        "bands": config["bands"],
+        "red": config.get("red"),
+        "nir": config.get("nir"),
+        "scaling": config["scaling"],
+        "level": config.get("level"),
+    }
+
+
+def get_platform_dates(platform):
+    """
+    Get the first and last dates with data of a platform, or of all platforms
+    if no platform is given. The last date is None for active platforms.
+    """
+    platforms = get_platforms()
+    if platform:
+        config = platforms[normalize_platform(platform)]
+        return config["start"], config.get("end")
+    start = min(config["start"] for config in platforms.values())
+    return start, None
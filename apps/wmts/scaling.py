@@ -0,0 +1,69 @@
+"""
+Scaling of pixel stacks to 8-bit images.
+
+Bands are stretched in place in a single float32 buffer with one precomputed
+scale factor per band, so that scaling a tile does not allocate intermediate
+arrays for the clipping, division and multiplication steps.
+"""
+import numpy
+
+
+def scale_to_uint8(stack, vmin=0, vmax=255, gamma=None, nodata=None, out=None):
+    """
+    Linearly stretch a pixel stack to a uint8 image.
+
+    Values between vmin and vmax are mapped to 0 to 255, values outside of
+    the range are clipped.
+
+    Parameters
+    ----------
+    stack : ndarray
+        The pixel data with shape (bands, height, width).
+    vmin, vmax : number or list, optional
+        The pixel values mapped to 0 and 255, either for all bands or a list
+        with one value per band.
+    gamma : number or list, optional
+        Gamma correction applied to the stretched values, for all bands or per
+        band. Values above 1 brighten the image. No correction by default.
+    nodata : number, optional
+        Pixels with this value in all bands are set to zero in all bands. Valid
+        pixels that would be zero in all bands are set to one, so that zero
+        marks the nodata pixels of the image.
+    out : ndarray, optional
+        A uint8 array with the shape of the stack to write the image into.
+
+    Returns
+    -------
+    img : ndarray
+        The uint8 image with shape (bands, height, width).
+    """
+    stack = numpy.asarray(stack)
+    bands = stack.shape[0]
+    vmin, vmax, gamma = (
+        [value] * bands if numpy.ndim(value) == 0 else list(value)
+        for value in (vmin, vmax, gamma)
+    )
+    if not len(vmin) == len(vmax) == len(gamma) == bands:
+        raise ValueError("Stretch values must be given for all {} bands.".format(bands))
+    if any(low >= high for low, high in zip(vmin, vmax)):
+        raise ValueError("Stretch minimum must be smaller than the maximum.")
+    if out is None:
+        out = numpy.empty(stack.shape, dtype="uint8")
+
+    buffer = numpy.empty(stack.shape[1:], dtype="float32")
+    for band, low, high, band_gamma, band_out in zip(stack, vmin, vmax, gamma, out):
+        numpy.subtract(band, numpy.float32(low), out=buffer, casting="unsafe")
+        buffer *= numpy.float32(255 / (high - low))
+        numpy.clip(buffer, 0, 255, out=buffer)
+        if band_gamma is not None:
+            buffer *= numpy.float32(1 / 255)
+            buffer **= numpy.float32(1 / band_gamma)
+            buffer *= numpy.float32(255)
+        numpy.copyto(band_out, buffer, casting="unsafe")
+    if nodata is not None:
+        # Transparency follows the nodata mask of the pixels, not the values
+        # of the scaled image.
+        mask = (stack == nodata).all(axis=0)
+        out[:, (out == 0).all(axis=0) & ~mask] = 1
+        out[:, mask] = 0
+    return out
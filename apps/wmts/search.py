@@ -0,0 +1,181 @@
+"""
+Shared scene searches for latest pixel tiles.
+
+Adjacent tiles at the same zoom level and end date resolve to nearly the same
+scene list. While rendering a tile, the catalog search of first_valid_pixel is
+replaced by a search over the footprint of a parent tile at a coarser zoom
+level. The results are cached per parent tile and search arguments, so that
+all tiles below the parent reuse a single catalog query. The cached scenes are
+filtered to the footprint of each tile.
+
+The search of first_valid_pixel is only routed through the cache while a tile
+is rendered, other users of the pixels library are not affected.
+"""
+import hashlib
+import inspect
+import json
+import math
+import threading
+from contextlib import contextmanager
+
+import mercantile
+from django.conf import settings
+from django.core.cache import caches
+from pixels import mosaic
+from wmts import const, timing
+
+# The parent tile and footprint of the tile being rendered in this thread.
+local = threading.local()
+
+# The catalog search used by first_valid_pixel.
+pixels_search_data = getattr(mosaic, "search_data", None)
+
+# Number of threads rendering with shared searches, the search of the pixels
+# library is routed through the cache while it is not zero.
+routing_lock = threading.Lock()
+routing_count = 0
+routed_search = None
+
+
+def get_search_tile(z, x, y, size=1):
+    """
+    Get the parent tile whose scene search is shared by a metatile.
+
+    Returns None if shared searches are disabled.
+    """
+    offset = settings.WMTS_SCENE_SEARCH_ZOOM_OFFSET
+    if not offset or pixels_search_data is None:
+        return
+    zoom = max(z - int(math.log2(size)) - offset, 0)
+    if zoom >= z:
+        return
+    return mercantile.parent(mercantile.Tile(x, y, z), zoom=zoom)
+
+
+@contextmanager
+def shared_scene_search(tile, geojson):
+    """
+    Resolve the scene searches of this thread over the parent tile footprint.
+
+    Searches are not changed if the tile is None.
+    """
+    global routing_count, routed_search
+    if tile is None:
+        yield
+        return
+    local.search = (tile, geojson)
+    with routing_lock:
+        if not routing_count:
+            routed_search = mosaic.search_data
+            mosaic.search_data = search_data
+        routing_count += 1
+    try:
+        yield
+    finally:
+        local.search = None
+        with routing_lock:
+            routing_count -= 1
+            if not routing_count:
+                mosaic.search_data = routed_search
+
+
+def positions(geometry):
+    """
+    Get the list of positions of a geojson geometry.
+    """
+    coords = geometry["coordinates"]
+    if not isinstance(coords[0], (list, tuple)):
+        return [coords]
+    while isinstance(coords[0][0], (list, tuple)):
+        coords = [coord for part in coords for coord in part]
+    return coords
+
+
+def bounds(coords):
+    """
+    Get the bounds of a list of positions.
+    """
+    xs, ys = [coord[0] for coord in coords], [coord[1] for coord in coords]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def geojson_bounds(geojson):
+    """
+    Get the longitude and latitude bounds of a geojson feature collection.
+
+    Coordinates are web mercator if the collection has that crs.
+    """
+    coords = [
+        coord
+        for feature in geojson["features"]
+        for coord in positions(feature["geometry"])
+    ]
+    if geojson.get("crs", {}).get("init") == "EPSG:3857":
+        coords = [mercantile.lnglat(*coord) for coord in coords]
+    return bounds(coords)
+
+
+def item_bounds(item):
+    """
+    Get the longitude and latitude bounds of a scene from its bbox or its
+    geometry. Returns None if the scene has no footprint.
+    """
+    if not isinstance(item, dict):
+        return
+    if item.get("bbox"):
+        return tuple(item["bbox"][:4])
+    if item.get("geometry"):
+        return bounds(positions(item["geometry"]))
+
+
+def intersecting_scenes(items, geojson, limit=None):
+    """
+    Filter scenes to the ones intersecting the bounds of the geojson, up to
+    the limit. Scenes without footprint are kept.
+    """
+    xmin, ymin, xmax, ymax = geojson_bounds(geojson)
+    result = []
+    for item in items:
+        footprint = item_bounds(item)
+        if footprint is None or (
+            footprint[0] <= xmax
+            and footprint[2] >= xmin
+            and footprint[1] <= ymax
+            and footprint[3] >= ymin
+        ):
+            result.append(item)
+            if limit and len(result) >= limit:
+                break
+    return result
+
+
+def search_data(*args, **kwargs):
+    """
+    Search scenes, using the cached results of the parent tile if set.
+    """
+    search = getattr(local, "search", None)
+    if search is None:
+        with timing.stage("search"):
+            return pixels_search_data(*args, **kwargs)
+    tile, geojson = search
+
+    arguments = inspect.signature(pixels_search_data).bind(*args, **kwargs)
+    arguments = arguments.arguments
+    child_geojson = arguments.pop("geojson", None)
+    limit = arguments.get("limit")
+    # The parent footprint is larger, allow for more candidate scenes.
+    if limit:
+        arguments["limit"] *= const.SCENE_SEARCH_LIMIT_FACTOR
+    data = json.dumps([tile, arguments], sort_keys=True, default=str)
+    key = "scenes-{}".format(hashlib.sha256(data.encode()).hexdigest())
+
+    cache = caches[settings.WMTS_SCENE_SEARCH_CACHE]
+    with timing.stage("search"):
+        items = cache.get(key)
+        if items is None:
+            items = pixels_search_data(geojson=geojson, **arguments)
+            cache.set(key, items, timeout=const.SCENE_SEARCH_TIMEOUT)
+    # Only return the scenes of the parent that cover the requested area.
+    if child_geojson is None:
+        return items[:limit] if limit else items
+    return intersecting_scenes(items, child_geojson, limit)
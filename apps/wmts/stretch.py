@@ -0,0 +1,102 @@
+"""
+Percentile contrast stretch for RGB tiles.
+
+With the auto stretch, the value range of the RGB tiles is derived from the
+pixel distribution of a parent tile at a coarser zoom level, instead of the
+fixed scaling of the platform. The percentiles are computed once per parent
+tile from a low resolution read, which uses the overviews of the scenes, and
+are cached. All tiles below the parent share the same stretch, so that there
+are no seams between neighboring tiles of a view. Concurrent requests for
+tiles below the same parent share a single read of the parent.
+"""
+import hashlib
+import json
+
+import mercantile
+import numpy
+from django.conf import settings
+from django.core.cache import caches
+from wmts import const
+from wmts.cache import SingleFlight, get_tile_cache
+
+# Concurrent computations of the same stretch within a process.
+stretch_flight = SingleFlight()
+
+
+def get_stretch_tile(z, x, y):
+    """
+    Get the parent tile whose statistics are used to stretch a tile.
+    """
+    zoom = max(z - const.STRETCH_ZOOM_OFFSET, 0)
+    return mercantile.parent(mercantile.Tile(x, y, z), zoom=zoom)
+
+
+def percentiles(stack, nodata=None):
+    """
+    Compute the lower and upper stretch percentiles of each band.
+
+    Nodata pixels are ignored. Returns the lists of minimum and maximum
+    values, or None if no valid pixels were found.
+    """
+    vmin, vmax = [], []
+    for band in stack:
+        band = numpy.asarray(band)
+        if nodata is not None:
+            band = band[band != nodata]
+        if not band.size:
+            return
+        low, high = numpy.percentile(band, const.STRETCH_PERCENTILES)
+        vmin.append(float(low))
+        # The stretch range can not be empty.
+        vmax.append(float(max(high, low + 1)))
+    return vmin, vmax
+
+
+def get_percentile_stretch(tile, read, **arguments):
+    """
+    Get the cached percentile stretch of a parent tile.
+
+    Parameters
+    ----------
+    tile : mercantile.Tile
+        The parent tile of the statistics.
+    read : callable
+        Function reading the pixels of the parent tile, returning the creation
+        arguments and the pixel stack. The stack is None if there are no
+        pixels.
+    **arguments
+        The search arguments of the pixels, used for the cache key.
+
+    Returns
+    -------
+    stretch : tuple or None
+        The lists of minimum and maximum values by band, or None if the parent
+        tile has no pixels.
+    """
+    data = json.dumps([tile, arguments], sort_keys=True, default=str)
+    key = "stretch-{}".format(hashlib.sha256(data.encode()).hexdigest())
+    stretch = caches[settings.WMTS_STRETCH_CACHE].get(key)
+    if stretch is None:
+        stretch = stretch_flight.do(key, compute_percentile_stretch, key, read)
+    return stretch or None
+
+
+def compute_percentile_stretch(key, read):
+    """
+    Compute the percentile stretch of a parent tile and store it in the cache.
+
+    The stretch key is locked across workers while reading the parent tile.
+    Returns the stretch, or an empty tuple if the parent tile has no pixels.
+    """
+    cache = caches[settings.WMTS_STRETCH_CACHE]
+    with get_tile_cache().lock(key):
+        # Another worker may have computed the stretch while waiting.
+        stretch = cache.get(key)
+        if stretch is None:
+            creation_args, stack = read()
+            if stack is not None:
+                stretch = percentiles(stack, creation_args.get("nodata"))
+            # Parent tiles without pixels are cached as well.
+            stretch = stretch or ()
+            cache.set(key, stretch, timeout=const.STRETCH_TIMEOUT)
+    return stretch
@@ -0,0 +1,408 @@
+import mercantile
+import numpy
+from pixels.mosaic import first_valid_pixel
+from wmts import composite, const, encoders, platforms, search, stretch, timing
+from wmts.algebra import colors, parser
+from wmts.algebra.const import ALGEBRA_PIXEL_TYPES
+from wmts.scaling import scale_to_uint8
+
+
+def tile_bounds(z, x, y, size=1):
+    """
+    Get the web mercator bounds of a tile, or of a block of size x size tiles
+    with the tile in its upper left corner.
+    """
+    bounds = mercantile.xy_bounds(x, y, z)
+    if size > 1:
+        lower_right = mercantile.xy_bounds(x + size - 1, y + size - 1, z)
+        bounds = (bounds[0], lower_right[1], lower_right[2], bounds[3])
+    return bounds
+
+
+def tile_geojson(z, x, y, size=1):
+    """
+    Get the geojson of the web mercator bounds of a tile, or of a block of
+    size x size tiles with the tile in its upper left corner.
+    """
+    bounds = tile_bounds(z, x, y, size)
+    return {
+        "type": "FeatureCollection",
+        "crs": {"init": "EPSG:3857"},
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [bounds[0], bounds[1]],
+                            [bounds[2], bounds[1]],
+                            [bounds[2], bounds[3]],
+                            [bounds[0], bounds[3]],
+                            [bounds[0], bounds[1]],
+                        ]
+                    ],
+                },
+            }
+        ],
+    }
+
+
+def get_metatile(z, x, y, size):
+    """
+    Get the upper left tile and the size of the metatile containing a tile.
+
+    Metatiles are aligned blocks of size x size tiles, the size is reduced at
+    zoom levels with less tiles.
+    """
+    size = min(size, 2**z)
+    return x - x % size, y - y % size, size
+
+
+def render_tile(z, x, y, end, **kwargs):
+    """
+    Render a single latest pixel tile, see render_metatile for the arguments.
+    """
+    tiles = render_metatile(z, x, y, end, size=1, **kwargs)
+    if tiles is not None:
+        return tiles[(x, y)]
+
+
+def render_metatile(
+    z,
+    x,
+    y,
+    end,
+    platform="",
+    max_cloud_cover_percentage=100,
+    bands=None,
+    formula=None,
+    pixel_type="float64",
+    frmt="png",
+    quality=None,
+    stretch_mode=None,
+    vmin=None,
+    vmax=None,
+    gamma=None,
+    composite_reducer=None,
+    start=None,
+    percentile=None,
+    dates=None,
+    size=const.METATILE_SIZE,
+):
+    """
+    Render the latest pixel or composite tiles of the metatile containing a
+    tile.
+
+    The pixels of all tiles in the metatile are fetched with a single search,
+    and then sliced into individual tiles.
+
+    Parameters
+    ----------
+    z, x, y : int
+        The tile indices.
+    end : str
+        The end date of the latest pixel search.
+    platform : str, optional
+        The platform to use from the platform registry. If not specified, the
+        platforms are chosen based on the end date.
+    max_cloud_cover_percentage : int, optional
+        Maximum cloud cover of the scenes to use.
+    bands : list, optional
+        The bands to use for the RGB image, defaults to the RGB bands of the
+        platform.
+    formula : str, optional
+        A raster algebra formula to evaluate and colorize instead of the RGB
+        image. Only the bands referenced in the formula are used.
+    pixel_type : str, optional
+        The pixel type used for formula evaluation.
+    frmt : str, optional
+        The image format of the tile, one of the keys of const.TILE_FORMATS.
+    quality : int, optional
+        The quality of lossy image formats.
+    stretch_mode : str, optional
+        With "auto", the RGB values are stretched between percentiles of the
+        pixels of a parent tile, instead of the fixed range of the platform.
+    vmin, vmax : float or list, optional
+        The pixel values mapped to the ends of the RGB range, for all bands or
+        by band. Override the range of the platform.
+    gamma : float or list, optional
+        Gamma correction of the RGB values, for all bands or by band.
+    composite_reducer : str, optional
+        Render a composite of the scenes between the start and end dates with
+        this reducer, see composite.composite_pixels.
+    start : str, optional
+        The start date of composites.
+    percentile : float, optional
+        The percentile of composites with the percentile reducer.
+    dates : list, optional
+        End dates of a time series of latest pixels. The formula is evaluated
+        on (time, height, width) stacks and has to reduce the time axis with
+        the temporal functions.
+    size : int, optional
+        The number of tiles along each side of the metatile, a power of two.
+
+    Returns
+    -------
+    tiles : dict or None
+        The encoded image data by (x, y) tile indices for all tiles of the
+        metatile. None if no pixels were found for the metatile.
+    """
+    # Compute tile scale and metatile bounds.
+    bounds = mercantile.xy_bounds(x, y, z)
+    scale = abs(bounds[3] - bounds[1]) / const.TILE_SIZE
+    xmin, ymin, size = get_metatile(z, x, y, size)
+    geojson = tile_geojson(z, xmin, ymin, size)
+    # Get the platforms to search and their default bands and scaling.
+    config = platforms.resolve_platform(platform, end)
+    platform = config["platforms"]
+    default_bands = config["bands"]
+    scaling = config["scaling"]
+    level = config["level"]
+    bands = bands or default_bands
+    # For formulas, only fetch the bands referenced in the formula.
+    if formula:
+        bands = sorted(parser.compile_formula(formula).variables) or bands
+    # Get the pixels of a composite or of the latest scenes.
+    if composite_reducer:
+        with timing.stage("read"):
+            creation_args, stack = composite.composite_pixels(
+                geojson,
+                tile_bounds(z, xmin, ymin, size),
+                (size * const.TILE_SIZE, size * const.TILE_SIZE),
+                start,
+                end,
+                bands,
+                platform,
+                composite_reducer,
+                percentile=percentile,
+                red=config["red"],
+                nir=config["nir"],
+                maxcloud=max_cloud_cover_percentage,
+                level=level,
+            )
+    elif dates:
+        with timing.stage("read"):
+            creation_args, stack = read_time_series(
+                z,
+                xmin,
+                ymin,
+                size,
+                dates,
+                scale,
+                ALGEBRA_PIXEL_TYPES[pixel_type],
+                bands=bands,
+                platforms=platform,
+                maxcloud=max_cloud_cover_percentage,
+                level=level,
+            )
+    else:
+        # Share the scene search with neighboring tiles. The search is timed
+        # separately from the pixel reads.
+        search_tile = search.get_search_tile(z, xmin, ymin, size)
+        search_geojson = search_tile and tile_geojson(
+            search_tile.z, search_tile.x, search_tile.y
+        )
+        with search.shared_scene_search(search_tile, search_geojson):
+            with timing.stage("read"):
+                creation_args, date, stack = first_valid_pixel(
+                    geojson,
+                    end,
+                    scale,
+                    bands=bands,
+                    platforms=platform,
+                    limit=10,
+                    clip=False,
+                    pool_bands=True,
+                    maxcloud=max_cloud_cover_percentage,
+                    level=level,
+                )
+
+    if stack is None:
+        return
+    timing.count("read_bytes", sum(dat.nbytes for dat in stack))
+
+    if formula:
+        # Apply formula.
+        with timing.stage("formula"):
+            img = parser.evaluate(
+                formula, bands, stack, dtype=ALGEBRA_PIXEL_TYPES[pixel_type]
+            )
+        # Colorize result.
+        colormap = {
+            "continuous": "True",
+            "to": [26, 152, 80],
+            "from": [215, 48, 39],
+            "over": [255, 255, 191],
+            "range": [-1, 1],
+        }
+        with timing.stage("colorize"):
+            img, stats = colors.colorize(img, colormap)
+            img = img.swapaxes(1, 2).swapaxes(0, 1)
+    else:
+        # Stretch the pixels of the parent tile, falling back to the range of
+        # the platform if the parent has no pixels.
+        if stretch_mode == const.STRETCH_AUTO:
+            with timing.stage("stretch"):
+                auto = get_auto_stretch(
+                    z,
+                    xmin,
+                    ymin,
+                    end,
+                    bands=bands,
+                    platforms=platform,
+                    maxcloud=max_cloud_cover_percentage,
+                    level=level,
+                )
+            vmin, vmax = auto or (vmin, vmax)
+        # Convert stack to image array in uint8.
+        with timing.stage("scale"):
+            img = scale_to_uint8(
+                stack,
+                0 if vmin is None else vmin,
+                scaling if vmax is None else vmax,
+                gamma,
+                nodata=creation_args.get("nodata"),
+            )
+        # Nodata pixels are zero in the scaled image.
+        if creation_args.get("nodata") is not None:
+            creation_args = dict(creation_args, nodata=0)
+    # Slice the metatile and encode the tiles directly from the array, the
+    # georeferencing is not needed for tiles.
+    tiles = {}
+    with timing.stage("encode"):
+        for row, strip in enumerate(numpy.split(img, size, axis=1)):
+            for col, tile in enumerate(numpy.split(strip, size, axis=2)):
+                tiles[(xmin + col, ymin + row)] = encoders.encode(
+                    tile, frmt, quality=quality, nodata=creation_args.get("nodata")
+                )
+    return tiles
+
+
+def read_time_series(z, x, y, size, dates, scale, dtype, **kwargs):
+    """
+    Read the latest pixels of a metatile for several end dates.
+
+    The dates are read concurrently. Returns the creation arguments and a
+    (bands, time, height, width) stack of the given pixel type, in which
+    nodata pixels and dates without data are NaN. The stack is None if there
+    are no pixels for any of the dates. The keyword arguments are passed to
+    the pixel search.
+    """
+    geojson = tile_geojson(z, x, y, size)
+    search_tile = search.get_search_tile(z, x, y, size)
+    search_geojson = search_tile and tile_geojson(
+        search_tile.z, search_tile.x, search_tile.y
+    )
+
+    def read(end):
+        # The searches of all dates share the parent tile.
+        with search.shared_scene_search(search_tile, search_geojson):
+            return first_valid_pixel(
+                geojson, end, scale, limit=10, clip=False, pool_bands=True, **kwargs
+            )
+
+    results = list(composite.get_scene_executor().map(read, dates))
+    if all(stack is None for args, date, stack in results):
+        return {}, None
+    pixels = size * const.TILE_SIZE
+    series = numpy.full(
+        (len(kwargs["bands"]), len(dates), pixels, pixels), numpy.nan, dtype=dtype
+    )
+    for index, (args, date, stack) in enumerate(results):
+        if stack is None:
+            continue
+        creation_args = args
+        nodata = args.get("nodata")
+        for band, data in zip(series, stack):
+            band[index] = data
+            if nodata is not None:
+                band[index][data == nodata] = numpy.nan
+    return creation_args, series
+
+
+def get_auto_stretch(z, x, y, end, **kwargs):
+    """
+    Get the percentile stretch of the parent tile of a tile, see
+    stretch.get_percentile_stretch. The keyword arguments are passed to the
+    pixel search.
+    """
+    tile = stretch.get_stretch_tile(z, x, y)
+
+    def read():
+        # Read the parent at the resolution of a single tile.
+        bounds = mercantile.xy_bounds(tile)
+        scale = abs(bounds[3] - bounds[1]) / const.TILE_SIZE
+        creation_args, date, stack = first_valid_pixel(
+            tile_geojson(tile.z, tile.x, tile.y),
+            end,
+            scale,
+            limit=10,
+            clip=False,
+            pool_bands=True,
+            **kwargs,
+        )
+        return creation_args, stack
+
+    return stretch.get_percentile_stretch(tile, read, end=end, **kwargs)
+
+
+def render_overview(children, frmt="png", quality=None):
+    """
+    Render a tile from the encoded tiles of its four children.
+
+    Parameters
+    ----------
+    children : dict
+        The encoded child tiles by (column, row) position in the parent tile,
+        with values of None for children without data.
+    frmt : str, optional
+        The image format of the tile, one of the keys of const.TILE_FORMATS.
+    quality : int, optional
+        The quality of lossy image formats.
+
+    Returns
+    -------
+    data : bytes or None
+        The encoded image data. None if none of the children has data.
+    """
+    with timing.stage("decode"):
+        decoded = {
+            position: encoders.decode(data)
+            for position, data in children.items()
+            if data is not None
+        }
+    if not decoded:
+        return
+    # Mosaic the children with their colors premultiplied by alpha, so that
+    # nodata pixels do not darken the average. Pixels with the nodata value
+    # and missing children are transparent.
+    size = const.TILE_SIZE
+    color = numpy.zeros((3, 2 * size, 2 * size), dtype="float32")
+    alpha = numpy.zeros((2 * size, 2 * size), dtype="float32")
+    has_alpha = len(decoded) < 4
+    nodata = None
+    for (col, row), (img, img_nodata) in decoded.items():
+        window = numpy.s_[row * size : (row + 1) * size, col * size : (col + 1) * size]
+        if img.shape[0] == 4:
+            has_alpha = True
+            alpha[window] = img[3]
+        elif img_nodata is not None:
+            nodata = img_nodata
+            alpha[window] = numpy.where((img == img_nodata).all(axis=0), 0, 255)
+        else:
+            alpha[window] = 255
+        color[(slice(None),) + window] = img[:3] * (alpha[window] / 255)
+    # Downsample by averaging blocks of 2x2 pixels, weighted by alpha.
+    color = color.reshape(3, size, 2, size, 2).sum(axis=(2, 4))
+    alpha = alpha.reshape(size, 2, size, 2).sum(axis=(1, 3))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        color *= 255 / alpha
+    color[:, alpha == 0] = 0 if nodata is None else nodata
+    if has_alpha:
+        img = numpy.concatenate([color, alpha[numpy.newaxis] / 4])
+    else:
+        img = color
+    img = numpy.round(img).astype("uint8")
+    with timing.stage("encode"):
+        return encoders.encode(img, frmt, quality=quality, nodata=nodata)
@@ -0,0 +1,134 @@
+"""
+Per-stage timing of tile requests.
+
+A sampled fraction of tile requests records the duration of each stage of the
+tile pipeline, such as the scene search, pixel reads, formula evaluation and
+encoding. The timings are sent to clients in a Server-Timing header and logged
+as structured fields. Stages of requests that are not sampled cost a single
+attribute lookup.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import structlog
+from django.conf import settings
+
+logger = structlog.getLogger(__name__)
+
+# The timer of the request handled in this thread.
+local = threading.local()
+
+
+class Timer(object):
+    """
+    Record the durations of the stages of a request and counters like the
+    number of bytes read.
+
+    Stages can be nested, the duration of a stage excludes the time spent in
+    its nested stages.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stop = None
+        self.durations = defaultdict(float)
+        self.counters = defaultdict(int)
+        # Time spent in nested stages, for each open stage.
+        self.nested = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            nested = self.nested.pop()
+            self.durations[name] += duration - nested
+            if self.nested:
+                self.nested[-1] += duration
+
+    def count(self, name, value):
+        self.counters[name] += value
+
+    def total(self):
+        return (self.stop or time.perf_counter()) - self.start
+
+    def header(self):
+        """
+        Format the timings as Server-Timing header value, in milliseconds.
+        """
+        metrics = [
+            "{};dur={:.1f}".format(name, 1000 * duration)
+            for name, duration in self.durations.items()
+        ]
+        metrics.extend(
+            '{};desc="{}"'.format(name, value) for name, value in self.counters.items()
+        )
+        metrics.append("total;dur={:.1f}".format(1000 * self.total()))
+        return ", ".join(metrics)
+
+    def fields(self):
+        """
+        Get the timings as log fields, in milliseconds.
+        """
+        fields = {
+            "{}_ms".format(name): round(1000 * duration, 1)
+            for name, duration in self.durations.items()
+        }
+        fields.update(self.counters)
+        fields["total_ms"] = round(1000 * self.total(), 1)
+        return fields
+
+
+def start():
+    """
+    Start timing the request of this thread, if it is sampled.
+
+    Returns the timer, or None if the request is not sampled.
+    """
+    rate = settings.WMTS_TIMING_SAMPLE_RATE
+    local.timer = Timer() if rate and random.random() < rate else None
+    return local.timer
+
+
+def finish(response, **fields):
+    """
+    Add the timings of this thread to a response and log them.
+
+    The fields are added to the log entry.
+    """
+    timer = getattr(local, "timer", None)
+    local.timer = None
+    if timer is None:
+        return response
+    timer.stop = time.perf_counter()
+    response["Server-Timing"] = timer.header()
+    logger.info("tile_timing", **fields, **timer.fields())
+    return response
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the request of this thread, if it is sampled.
+    """
+    timer = getattr(local, "timer", None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def count(name, value):
+    """
+    Add to a counter of the request of this thread, if it is sampled.
+    """
+    timer = getattr(local, "timer", None)
+    if timer is not None:
+        timer.count(name, value)
@@ -1,12 +1,23 @@
+import hashlib
 import os
 
 import numpy
 import rasterio
 import sentry_sdk
+from django.conf import settings
 from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from pixels import const
 from pixels.exceptions import PixelsException
-from wmts import algebra
+from rest_framework.exceptions import ValidationError
+from wmts.algebra.parser import FormulaParser, compile_formula
+from wmts.const import (
+    PLACEHOLDER_IMAGE,
+    PLACEHOLDER_NONE,
+    PLACEHOLDER_TRANSPARENT,
+    PLACEHOLDERS,
+)
+from wmts.encoders import encode_png
 
 
 def rescale_to_channel_range(data, dfrom, dto, dover=None):
@@ -144,11 +155,12 @@ def get_s2_formula_pixels(
     frmt,
 ):
     # Instantiate formula parser.
-    parser = algebra.FormulaParser()
+    parser = FormulaParser()
+    variables = compile_formula(formula).variables
     data = {}
     # Get pixels for all bands present in formula.
     for band in const.SENTINEL_2_BANDS:
-        if band in formula:
+        if band in variables:
             try:
                 with rasterio.open(
                     "zip+s3://{}/{}/tiles/{}/{}/{}/pixels.zip!{}.tif".format(
@@ -191,8 +203,82 @@ def get_s2_formula_pixels(
     return red, green, blue, mask
 
 
-def get_empty_response(zoom=True):
-    path = os.path.dirname(os.path.abspath(__file__))
-    filename = "assets/tesselo_zoom_in_more.png" if zoom else "assets/tesselo_empty.png"
-    path = os.path.join(path, filename)
-    return HttpResponse(open(path, "rb"), content_type="image/png")
+def read_asset(filename):
+    """
+    Read the content of a file in the assets directory.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+    with open(os.path.join(path, filename), "rb") as fl:
+        return fl.read()
+
+
+# Placeholder tiles are loaded once, they are served for every tile that is
+# out of range or has no data.
+ZOOM_IN_TILE = read_asset("tesselo_zoom_in_more.png")
+EMPTY_TILE = read_asset("tesselo_empty.png")
+TRANSPARENT_TILE = encode_png(numpy.zeros((4, 1, 1), dtype="uint8"))
+# Placeholder tiles only change with the assets.
+PLACEHOLDER_VERSION = hashlib.sha256(
+    ZOOM_IN_TILE + EMPTY_TILE + TRANSPARENT_TILE
+).hexdigest()
+
+
+def get_placeholder(request):
+    """
+    Get the type of placeholder tiles from the request.
+    """
+    placeholder = request.GET.get("placeholder", settings.WMTS_TILE_PLACEHOLDER)
+    if placeholder not in PLACEHOLDERS:
+        raise ValidationError(
+            {"placeholder": f"Placeholder must be one of {list(PLACEHOLDERS)}."}
+        )
+    return placeholder
+
+
+def get_empty_response(zoom=True, placeholder=PLACEHOLDER_IMAGE):
+    """
+    Get a placeholder tile response.
+
+    The zoom flag selects the image asking users to zoom in instead of the
+    image for tiles without data. Clients that support it can ask for an empty
+    204 response or a transparent 1x1 tile instead.
+    """
+    if placeholder == PLACEHOLDER_NONE:
+        response = HttpResponse(status=204)
+        del response["Content-Type"]
+        return response
+    elif placeholder == PLACEHOLDER_TRANSPARENT:
+        data = TRANSPARENT_TILE
+    else:
+        data = ZOOM_IN_TILE if zoom else EMPTY_TILE
+    return HttpResponse(data, content_type="image/png")
+
+
+def set_cache_headers(response, etag, max_age, vary=()):
+    """
+    Set the ETag and public caching headers on a response.
+    """
+    if etag:
+        response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
+
+
+def negotiate_tile_format(request, frmt):
+    """
+    Choose the tile format for generic png urls from the Accept header.
+
+    WebP is only served to clients that list it explicitly, wildcards are
+    answered with png.
+    """
+    if frmt != "png" or not settings.WMTS_TILE_NEGOTIATION:
+        return frmt
+    accepted = [
+        media.split(";")[0].strip()
+        for media in request.META.get("HTTP_ACCEPT", "").split(",")
+    ]
+    if "image/webp" in accepted:
+        return "webp"
+    return frmt
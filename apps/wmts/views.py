@@ -1,16 +1,31 @@
 import datetime
-import io
+import hashlib
 
 import mercantile
 import numpy
-import rasterio
+from django.conf import settings
 from django.http import HttpResponse
-from pixels.mosaic import first_valid_pixel
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from tsuser.const import GET_QUERY_PARAMETER_AUTH_KEY
-from wmts import const, wmts
-from wmts.algebra import colors, parser
-from wmts.utils import get_empty_response
+from wmts import const, platforms, search, timing, wmts
+from wmts.algebra import parser
+from wmts.algebra.const import ALGEBRA_PIXEL_TYPES, TEMPORAL_FUNCTIONS
+from wmts.algebra.exceptions import RasterAlgebraException
+from wmts.cache import SingleFlight, get_tile_cache, tile_cache_key
+from wmts.tiles import get_metatile, render_metatile, render_overview, render_tile
+from wmts.utils import (
+    PLACEHOLDER_VERSION,
+    get_empty_response,
+    get_placeholder,
+    negotiate_tile_format,
+    set_cache_headers,
+)
+
+# Coalesces concurrent renders of the same tiles within a worker.
+tile_flight = SingleFlight()
 
 
 @api_view(["GET"])
@@ -18,6 +33,8 @@ def wmtsview(request, platform=""):
     """
     WMTS endpoint with monthly latest pixel layers.
     """
+    if platform and not platforms.is_platform(platform):
+        raise NotFound("Unknown platform {}.".format(platform))
     # Get auth key.
     key = request.GET.get(GET_QUERY_PARAMETER_AUTH_KEY, None)
     # Get cloud cover query argument.
@@ -28,136 +45,394 @@ def wmtsview(request, platform=""):
     urlbase = "{}://{}".format(protocol, host)
     # Generate WMTS xml.
     xml = wmts.gen(key, urlbase, max_cloud_cover_percentage, platform)
+    # Answer conditional requests if the document did not change.
+    etag = quote_etag(hashlib.sha256(xml.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(xml, content_type="text/xml")
     # Return xml to user.
-    return HttpResponse(xml, content_type="text/xml")
+    return set_cache_headers(response, etag, const.CAPABILITIES_MAX_AGE)
 
 
-@api_view(["GET"])
-def tilesview(request, z, x, y, platform=""):
+def get_tile_parameters(request, platform="", frmt="png"):
     """
-    TMS tiles endpoint.
+    Get the normalized tile rendering parameters from the request.
     """
-    # Check for minimum zoom.
-    if z < const.PIXELS_MIN_ZOOM:
-        return get_empty_response()
+    # Get image format, the generic png urls are negotiated.
+    if frmt not in const.TILE_FORMATS:
+        raise NotFound("Unknown tile format {}.".format(frmt))
+    if platform and not platforms.is_platform(platform):
+        raise NotFound("Unknown platform {}.".format(platform))
+    frmt = negotiate_tile_format(request, frmt)
+    return parse_tile_parameters(request.GET, platform, frmt)
+
 
+def parse_tile_parameters(query, platform="", frmt="png"):
+    """
+    Get the normalized tile rendering parameters from query arguments.
+    """
+    # Get quality for lossy formats.
+    quality = None
+    if frmt != "png":
+        try:
+            quality = int(query.get("quality", settings.WMTS_TILE_QUALITY))
+        except ValueError:
+            quality = 0
+        if not 1 <= quality <= 100:
+            raise ValidationError({"quality": "Quality must be between 1 and 100."})
     # Retrieve end date from query args.
-    end = request.GET.get("end")
+    end = query.get("end")
     if not end:
         end = str(datetime.datetime.now().date())
     # Get cloud cover filter.
-    max_cloud_cover_percentage = int(request.GET.get("max_cloud_cover_percentage", 100))
-    # Compute tile bounds and scale.
-    bounds = mercantile.xy_bounds(x, y, z)
-    scale = abs(bounds[3] - bounds[1]) / const.TILE_SIZE
-    geojson = {
-        "type": "FeatureCollection",
-        "crs": {"init": "EPSG:3857"},
-        "features": [
+    max_cloud_cover_percentage = int(query.get("max_cloud_cover_percentage", 100))
+    # Get pixel type for formula evaluation.
+    pixel_type = query.get("pixel_type", settings.WMTS_ALGEBRA_PIXEL_TYPE)
+    if pixel_type not in ALGEBRA_PIXEL_TYPES:
+        raise ValidationError(
+            {"pixel_type": f"Pixel type must be one of {list(ALGEBRA_PIXEL_TYPES)}."}
+        )
+    # Obtain bands from request.
+    bands = None
+    if "bands" in query:
+        bands = query.get("bands").split(",")
+    # Compile formula to ensure it is valid before fetching any pixels.
+    formula = query.get("formula")
+    if formula:
+        try:
+            formula = parser.compile_formula(formula).formula
+        except RasterAlgebraException as e:
+            raise ValidationError({"formula": str(e)})
+
+    params = {
+        "end": end,
+        "platform": platforms.normalize_platform(platform),
+        "max_cloud_cover_percentage": max_cloud_cover_percentage,
+        "bands": bands,
+        "formula": formula,
+        "pixel_type": pixel_type,
+        "frmt": frmt,
+        "quality": quality,
+    }
+    # Only add the stretch, composite and temporal parameters if given, so
+    # that the cache keys of other tiles do not change.
+    scaling = platforms.resolve_platform(params["platform"], end)["scaling"]
+    params.update(parse_stretch_parameters(query, len(bands) if bands else 3, scaling))
+    params.update(parse_composite_parameters(query, params["platform"], end))
+    params.update(parse_temporal_parameters(query, formula))
+    return params
+
+
+def parse_temporal_parameters(query, formula):
+    """
+    Get the dates of temporal formulas from query arguments.
+
+    The formula is evaluated over the latest pixels of each date and has to
+    reduce the time axis with the temporal functions. The last date is used
+    as end date of the tile.
+    """
+    dates = query.get("dates")
+    if not dates:
+        if formula and set(parser.compile_formula(formula).program).intersection(
+            TEMPORAL_FUNCTIONS
+        ):
+            raise ValidationError(
+                {"dates": "Formulas with temporal functions require dates."}
+            )
+        return {}
+    dates = sorted(set(dates.split(",")))
+    try:
+        for date in dates:
+            datetime.date.fromisoformat(date)
+    except ValueError:
+        raise ValidationError({"dates": "Dates must be in the YYYY-MM-DD format."})
+    if not 2 <= len(dates) <= const.TEMPORAL_MAX_DATES:
+        raise ValidationError(
+            {"dates": f"Give between 2 and {const.TEMPORAL_MAX_DATES} dates."}
+        )
+    if not formula:
+        raise ValidationError({"dates": "Dates require a formula."})
+    if "composite" in query:
+        raise ValidationError({"dates": "Dates can not be used with composites."})
+    # Evaluate the formula on a single pixel to ensure that the time axis is
+    # reduced.
+    registers = parser.compile_formula(formula).registers
+    data = {name: numpy.ones((len(dates), 1, 1)) for name in registers.variables}
+    try:
+        result = registers.evaluate(data, use_numexpr=False)
+    except (RasterAlgebraException, ValueError):
+        result = None
+    if numpy.ndim(result) != 2:
+        raise ValidationError(
             {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [
-                        [
-                            [bounds[0], bounds[1]],
-                            [bounds[2], bounds[1]],
-                            [bounds[2], bounds[3]],
-                            [bounds[0], bounds[3]],
-                            [bounds[0], bounds[1]],
-                        ]
-                    ],
-                },
+                "formula": "Formulas over several dates must reduce the time "
+                f"axis once with one of {list(TEMPORAL_FUNCTIONS)}."
             }
-        ],
-    }
-    # Specify the platform to use.
-    platform = platform.upper().replace("-", "_")
-    level = None
-    if platform == "LANDSAT_4":
-        bands = ["B3", "B2", "B1"]
-        scaling = 100
-    elif platform == "LANDSAT_5":
-        platform = ["LANDSAT_5"]
-        bands = ["B3", "B2", "B1"]
-        scaling = 100
-    elif not platform and end < "2000-01-01":
-        platform = ["LANDSAT_4", "LANDSAT_5"]
-        bands = ["B3", "B2", "B1"]
-        scaling = 100
-    elif platform == "LANDSAT_7" or (not platform and end < "2014-01-01"):
-        platform = ["LANDSAT_7"]
-        bands = ["B3", "B2", "B1"]
-        scaling = 255
-    elif platform == "LANDSAT_8" or (not platform and end < "2018-01-01"):
-        print("LS8")
-        platform = ["LANDSAT_8"]
-        bands = ["B4", "B3", "B2"]
-        scaling = 30000
+        )
+    return {"end": dates[-1], "dates": dates}
+
+
+def parse_composite_parameters(query, platform, end):
+    """
+    Get the composite parameters from query arguments.
+    """
+    composite_reducer = query.get("composite")
+    if not composite_reducer:
+        return {}
+    if search.pixels_search_data is None:
+        raise ValidationError({"composite": "Composites are not available."})
+    if composite_reducer not in const.COMPOSITE_REDUCERS:
+        raise ValidationError(
+            {
+                "composite": "Composite must be one of "
+                f"{list(const.COMPOSITE_REDUCERS)}."
+            }
+        )
+    params = {"composite_reducer": composite_reducer}
+    # Get the date window.
+    start = query.get("start")
+    try:
+        datetime.date.fromisoformat(start or "")
+    except ValueError:
+        raise ValidationError({"start": "Composites require a start date."})
+    if start >= end:
+        raise ValidationError({"start": "Start must be before the end date."})
+    params["start"] = start
+    # Get the percentile of the percentile reducer.
+    if composite_reducer == const.COMPOSITE_PERCENTILE:
+        try:
+            percentile = float(query.get("percentile", ""))
+        except ValueError:
+            percentile = -1
+        if not 0 <= percentile <= 100:
+            raise ValidationError(
+                {"percentile": "Percentile must be between 0 and 100."}
+            )
+        params["percentile"] = percentile
+    # The greenest pixel requires the red and near infrared bands.
+    if composite_reducer == const.COMPOSITE_GREENEST:
+        config = platforms.resolve_platform(platform, end)
+        if not config["red"] or not config["nir"]:
+            raise ValidationError(
+                {"composite": "The platform has no red and near infrared bands."}
+            )
+    return params
+
+
+def parse_stretch_parameters(query, band_count, scaling):
+    """
+    Get the contrast stretch parameters of RGB tiles from query arguments.
+
+    The stretch values are given for all bands or as comma separated list
+    with one value per band. Missing stretch limits default to zero and the
+    scaling of the platform.
+    """
+    params = {}
+    stretch_mode = query.get("stretch")
+    if stretch_mode:
+        if stretch_mode not in const.STRETCH_MODES:
+            raise ValidationError(
+                {"stretch": f"Stretch must be one of {list(const.STRETCH_MODES)}."}
+            )
+        params["stretch_mode"] = stretch_mode
+    for name in ("vmin", "vmax", "gamma"):
+        if name not in query:
+            continue
+        try:
+            values = [float(value) for value in query.get(name).split(",")]
+        except ValueError:
+            values = []
+        if len(values) not in (1, band_count) or not numpy.all(numpy.isfinite(values)):
+            raise ValidationError(
+                {name: f"Give one number or {band_count} comma separated numbers."}
+            )
+        params[name] = values[0] if len(values) == 1 else values
+    # Validate the stretch ranges.
+    if any(value <= 0 for value in numpy.ravel(params.get("gamma", 1))):
+        raise ValidationError({"gamma": "Gamma must be positive."})
+    if numpy.any(numpy.less_equal(params.get("vmax", scaling), params.get("vmin", 0))):
+        raise ValidationError(
+            {
+                "vmax"
+                if "vmax" in params
+                else "vmin": "Maximum must be larger "
+                f"than minimum, the defaults are 0 and {scaling}."
+            }
+        )
+    return params
+
+
+def render_cached_metatile(z, x, y, metatile_key, params, size=None):
+    """
+    Render the metatile containing a tile and store its tiles in the cache.
+
+    The metatile is locked across workers while rendering. Returns the tiles
+    by (x, y) indices, or an empty dict if another worker rendered the tile
+    while waiting for the lock. The metatile size defaults to the setting.
+    """
+    cache = get_tile_cache()
+    with cache.lock(metatile_key):
+        if cache.get(tile_cache_key(z, x, y, **params)) is not None:
+            return {}
+        tiles = render_metatile(
+            z, x, y, size=size or settings.WMTS_METATILE_SIZE, **params
+        )
+        tiles = tiles or {}
+        with timing.stage("cache"):
+            for (tile_x, tile_y), data in tiles.items():
+                cache.set(tile_cache_key(z, tile_x, tile_y, **params), data)
+    return tiles
+
+
+def render_cached_overview(z, x, y, params):
+    """
+    Render an overview tile from its cached children.
+
+    Overviews from OVERVIEW_RENDER_MIN_ZOOM on render their missing children,
+    lower overviews use the children that are cached, which requires seeding
+    the area with the seedtiles command. The overview is only stored in the
+    cache once all of its children are cached or known to have no data, so
+    that overviews are complete.
+    """
+    cache = get_tile_cache()
+    missing = []
+    children = {}
+    for child in mercantile.children(x, y, z):
+        data = cache.get(tile_cache_key(child.z, child.x, child.y, **params))
+        if data is None:
+            missing.append(child)
+        children[(child.x - 2 * x, child.y - 2 * y)] = data
+    complete = not missing
+    if missing and z >= const.OVERVIEW_RENDER_MIN_ZOOM:
+        if z + 1 >= const.PIXELS_MIN_ZOOM:
+            # Render the children as one block of 2x2 tiles, with a single
+            # search and read. Rendered pixel tiles are final, even without
+            # data.
+            block_key = tile_cache_key(z + 1, 2 * x, 2 * y, metatile=2, **params)
+            first = missing[0]
+            tiles = render_cached_metatile(
+                first.z, first.x, first.y, block_key, params, size=2
+            )
+            complete = True
+        else:
+            tiles = {
+                (child.x, child.y): get_cached_tile(child.z, child.x, child.y, params)
+                for child in missing
+            }
+        for child in missing:
+            key = tile_cache_key(child.z, child.x, child.y, **params)
+            children[(child.x - 2 * x, child.y - 2 * y)] = tiles.get(
+                (child.x, child.y)
+            ) or cache.get(key)
+    data = render_overview(children, params["frmt"], params["quality"])
+    if data is not None and complete:
+        cache.set(tile_cache_key(z, x, y, **params), data)
+    return data
+
+
+def render_current_overview(z, x, y, params):
+    """
+    Render an overview tile of the current date from its children, which are
+    not cached. Pixel tiles are rendered as one block of 2x2 tiles.
+    """
+    if z + 1 >= const.PIXELS_MIN_ZOOM:
+        tiles = render_metatile(z + 1, 2 * x, 2 * y, size=2, **params) or {}
     else:
-        platform = ["SENTINEL_2"]
-        bands = ["B04", "B03", "B02"]
-        scaling = 4000
-        level = "L2A"
-    # Obtain bands from request.
-    if "bands" in request.GET:
-        bands = request.GET.get("bands").split(",")
-    # Get pixels.
-    creation_args, date, stack = first_valid_pixel(
-        geojson,
-        end,
-        scale,
-        bands=bands,
-        platforms=platform,
-        limit=10,
-        clip=False,
-        pool_bands=True,
-        maxcloud=max_cloud_cover_percentage,
-        level=level,
-    )
-
-    if stack is None:
-        return get_empty_response(zoom=False)
-
-    if "formula" in request.GET:
-        # Obtain bands from request.
-        bands = request.GET.get("bands").split(",")
-        # Apply formula.
-        formula = request.GET.get("formula")
-        img = parser.evaluate(formula, bands, stack)
-        # Colorize result.
-        colormap = {
-            "continuous": "True",
-            "to": [26, 152, 80],
-            "from": [215, 48, 39],
-            "over": [255, 255, 191],
-            "range": [-1, 1],
+        tiles = {
+            (child.x, child.y): render_current_overview(
+                child.z, child.x, child.y, params
+            )
+            for child in mercantile.children(x, y, z)
         }
-        img, stats = colors.colorize(img, colormap)
-        count = 4
-        img = img.swapaxes(1, 2).swapaxes(0, 1)
+    children = {
+        (child_x - 2 * x, child_y - 2 * y): data
+        for (child_x, child_y), data in tiles.items()
+    }
+    return render_overview(children, params["frmt"], params["quality"])
+
+
+def get_cached_tile(z, x, y, params):
+    """
+    Get a tile from the cache, rendering its metatile if it is not cached.
+    Overview tiles below the minimum zoom for pixels are rendered from their
+    cached children.
+
+    Concurrent calls for tiles of the same metatile share a single render.
+    Returns None for tiles without data.
+    """
+    cache = get_tile_cache()
+    key = tile_cache_key(z, x, y, **params)
+    with timing.stage("cache"):
+        data = cache.get(key)
+    if data is None and z < const.PIXELS_MIN_ZOOM:
+        data = tile_flight.do(key, render_cached_overview, z, x, y, params)
+    elif data is None:
+        xmin, ymin, size = get_metatile(z, x, y, settings.WMTS_METATILE_SIZE)
+        metatile_key = tile_cache_key(z, xmin, ymin, metatile=size, **params)
+        tiles = tile_flight.do(
+            metatile_key, render_cached_metatile, z, x, y, metatile_key, params
+        )
+        data = tiles.get((x, y)) or cache.get(key)
+    return data
+
+
+@api_view(["GET"])
+def tilesview(request, z, x, y, platform="", frmt="png"):
+    """
+    TMS tiles endpoint.
+    """
+    placeholder = get_placeholder(request)
+    # Check for minimum zoom.
+    if z < const.OVERVIEW_MIN_ZOOM:
+        etag = quote_etag("{}-{}".format(PLACEHOLDER_VERSION, placeholder))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = get_empty_response(placeholder=placeholder)
+        return set_cache_headers(response, etag, const.PLACEHOLDER_MAX_AGE)
+
+    params = get_tile_parameters(request, platform, frmt)
+    # Time the stages of sampled requests.
+    timing.start()
+    # Responses of negotiated urls depend on the Accept header.
+    vary = ["Accept"] if frmt == "png" and settings.WMTS_TILE_NEGOTIATION else []
+
+    # Tiles up to the current date can still change, so only tiles for past
+    # dates are cached. For current tiles the ETag changes daily.
+    today = str(datetime.datetime.now().date())
+    historical = params["end"] < today
+    key = tile_cache_key(z, x, y, **params)
+    tag = key if historical else "{}-{}".format(key, today)
+    # Tiles without data are answered with the requested placeholder.
+    if placeholder != const.PLACEHOLDER_IMAGE:
+        etag = quote_etag("{}-{}".format(tag, placeholder))
     else:
-        # Convert stack to image array in uint8.
-        img = numpy.array(
-            [255 * (numpy.clip(dat, 0, scaling) / scaling) for dat in stack]
-        ).astype("uint8")
-        count = 3
-    # Prepare PNG output parameters.
-    creation_args.update(
-        {
-            "driver": "PNG",
-            "dtype": "uint8",
-            "count": count,
-        }
-    )
-    # Write data to PNG BytesIO buffer.
-    output = io.BytesIO()
-    with rasterio.io.MemoryFile() as memfile:
-        with memfile.open(**creation_args) as dst:
-            dst.write(img)
-        memfile.seek(0)
-        output.write(memfile.read())
-
-    # Send file buffer.
-    output.seek(0)
-    return HttpResponse(output, content_type="image/png")
+        etag = quote_etag(tag)
+    max_age = const.TILE_MAX_AGE if historical else const.CURRENT_TILE_MAX_AGE
+
+    # Answer conditional requests without rendering.
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response = set_cache_headers(response, etag, max_age, vary)
+        return timing.finish(response, z=z, x=x, y=y, **params)
+
+    # Concurrent requests for the same tiles share a single render.
+    overview = z < const.PIXELS_MIN_ZOOM
+    if historical:
+        data = get_cached_tile(z, x, y, params)
+    elif not overview:
+        data = tile_flight.do(tag, render_tile, z, x, y, **params)
+    elif z >= const.OVERVIEW_RENDER_MIN_ZOOM:
+        data = tile_flight.do(tag, render_current_overview, z, x, y, params)
+    else:
+        data = None
+    # Overviews are final once they are cached, others are incomplete and
+    # only cached briefly by clients.
+    if overview and (data is None or get_tile_cache().get(key) is None):
+        etag = None
+        max_age = const.CURRENT_TILE_MAX_AGE
+    if data is None:
+        response = get_empty_response(zoom=overview, placeholder=placeholder)
+    else:
+        response = HttpResponse(data, content_type=const.TILE_FORMATS[params["frmt"]])
+    response = set_cache_headers(response, etag, max_age, vary)
+    return timing.finish(response, z=z, x=x, y=y, **params)
@@ -1,4 +1,7 @@
 import datetime
+from functools import lru_cache
+
+from wmts import const, platforms
 
 WMTS_BASE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
 <Capabilities xmlns="http://www.opengis.net/wmts/1.0" xmlns:ows="http://www.opengis.net/ows/1.1" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:gml="http://www.opengis.net/gml" xsi:schemaLocation="http://www.opengis.net/wmts/1.0 http://schemas.opengis.net/wmts/1.0/wmtsGetCapabilities_response.xsd" version="1.0.0">
@@ -19,6 +22,17 @@ WMTS_BASE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
 </Capabilities>
 """
 
+TILE_MATRIX_TEMPLATE = """
+    <TileMatrix>
+    <ows:Identifier>{zoom}</ows:Identifier>
+    <ScaleDenominator>{scale}</ScaleDenominator>
+    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
+    <TileWidth>256</TileWidth>
+    <TileHeight>256</TileHeight>
+    <MatrixWidth>{size}</MatrixWidth>
+    <MatrixHeight>{size}</MatrixHeight>
+    </TileMatrix>"""
+
 TILE_MATRIX_SET_TEMPLATE = """
 <TileMatrixSet>
     <ows:Identifier>epsg3857</ows:Identifier>
@@ -27,187 +41,7 @@ TILE_MATRIX_SET_TEMPLATE = """
     <ows:UpperCorner>20037508.342789244 20037508.342789244</ows:UpperCorner>
     </ows:BoundingBox>
     <ows:SupportedCRS>urn:ogc:def:crs:EPSG:6.18.3:3857</ows:SupportedCRS>
-    <WellKnownScaleSet>urn:ogc:def:wkss:OGC:1.0:GoogleMapsCompatible</WellKnownScaleSet>
-    <TileMatrix>
-    <ows:Identifier>0</ows:Identifier>
-    <ScaleDenominator>559082264.0287178</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>1</MatrixWidth>
-    <MatrixHeight>1</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>1</ows:Identifier>
-    <ScaleDenominator>279541132.0143589</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>2</MatrixWidth>
-    <MatrixHeight>2</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>2</ows:Identifier>
-    <ScaleDenominator>139770566.00717944</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>4</MatrixWidth>
-    <MatrixHeight>4</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>3</ows:Identifier>
-    <ScaleDenominator>69885283.00358972</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>8</MatrixWidth>
-    <MatrixHeight>8</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>4</ows:Identifier>
-    <ScaleDenominator>34942641.50179486</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>16</MatrixWidth>
-    <MatrixHeight>16</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>5</ows:Identifier>
-    <ScaleDenominator>17471320.75089743</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>32</MatrixWidth>
-    <MatrixHeight>32</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>6</ows:Identifier>
-    <ScaleDenominator>8735660.375448715</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>64</MatrixWidth>
-    <MatrixHeight>64</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>7</ows:Identifier>
-    <ScaleDenominator>4367830.1877243575</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>128</MatrixWidth>
-    <MatrixHeight>128</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>8</ows:Identifier>
-    <ScaleDenominator>2183915.0938621787</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>256</MatrixWidth>
-    <MatrixHeight>256</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>9</ows:Identifier>
-    <ScaleDenominator>1091957.5469310894</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>512</MatrixWidth>
-    <MatrixHeight>512</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>10</ows:Identifier>
-    <ScaleDenominator>545978.7734655447</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>1024</MatrixWidth>
-    <MatrixHeight>1024</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>11</ows:Identifier>
-    <ScaleDenominator>272989.38673277234</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>2048</MatrixWidth>
-    <MatrixHeight>2048</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>12</ows:Identifier>
-    <ScaleDenominator>136494.69336638617</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>4096</MatrixWidth>
-    <MatrixHeight>4096</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>13</ows:Identifier>
-    <ScaleDenominator>68247.34668319309</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>8192</MatrixWidth>
-    <MatrixHeight>8192</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>14</ows:Identifier>
-    <ScaleDenominator>34123.67334159654</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>16384</MatrixWidth>
-    <MatrixHeight>16384</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>15</ows:Identifier>
-    <ScaleDenominator>17061.83667079827</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>32768</MatrixWidth>
-    <MatrixHeight>32768</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>16</ows:Identifier>
-    <ScaleDenominator>8530.918335399136</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>65536</MatrixWidth>
-    <MatrixHeight>65536</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>17</ows:Identifier>
-    <ScaleDenominator>4265.459167699568</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>131072</MatrixWidth>
-    <MatrixHeight>131072</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>18</ows:Identifier>
-    <ScaleDenominator>2132.729583849784</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>262144</MatrixWidth>
-    <MatrixHeight>262144</MatrixHeight>
-    </TileMatrix>
-    <TileMatrix>
-    <ows:Identifier>19</ows:Identifier>
-    <ScaleDenominator>1066.364791924892</ScaleDenominator>
-    <TopLeftCorner>-20037508.342789244 20037508.342789244</TopLeftCorner>
-    <TileWidth>256</TileWidth>
-    <TileHeight>256</TileHeight>
-    <MatrixWidth>524288</MatrixWidth>
-    <MatrixHeight>524288</MatrixHeight>
-    </TileMatrix>
+    <WellKnownScaleSet>urn:ogc:def:wkss:OGC:1.0:GoogleMapsCompatible</WellKnownScaleSet>{matrices}
 </TileMatrixSet>
 """
 
@@ -222,55 +56,125 @@ TILE_LAYER_TEMPLATE = """
     <Style isDefault="true">
             <ows:Identifier>Default</ows:Identifier>
     </Style>
-    <Format>image/png</Format>
+{formats}
     <TileMatrixSetLink>
         <TileMatrixSet>epsg3857</TileMatrixSet>
     </TileMatrixSetLink>
-    <ResourceURL format="image/png" template="{url}" resourceType="tile"/>
+{resources}
 </Layer>
 """
 
-LATEST_PIXEL_URL_TEMPLATE = "{host}/tiles/{{TileMatrix}}/{{TileCol}}/{{TileRow}}.png?key={key}&amp;end={end}&amp;max_cloud_cover_percentage={cloud}"
-LATEST_PIXEL_PLATFORM_URL_TEMPLATE = "{host}/tiles/{platform}/{{TileMatrix}}/{{TileCol}}/{{TileRow}}.png?key={key}&amp;end={end}&amp;max_cloud_cover_percentage={cloud}"
+TILE_FORMAT_TEMPLATE = "    <Format>{content_type}</Format>"
+TILE_RESOURCE_TEMPLATE = (
+    '    <ResourceURL format="{content_type}" template="{url}" resourceType="tile"/>'
+)
 
+LATEST_PIXEL_URL_TEMPLATE = "{host}/tiles/{{TileMatrix}}/{{TileCol}}/{{TileRow}}.{extension}?key={key}&amp;end={end}&amp;max_cloud_cover_percentage={cloud}"
+LATEST_PIXEL_PLATFORM_URL_TEMPLATE = "{host}/tiles/{platform}/{{TileMatrix}}/{{TileCol}}/{{TileRow}}.{extension}?key={key}&amp;end={end}&amp;max_cloud_cover_percentage={cloud}"
 
-def gen(key, host, max_cloud_cover_percentage=100, platform=None):
+
+# Placeholder for the user key in the cached documents.
+KEY_PLACEHOLDER = "{{key}}"
+
+# The tile formats are the same for all layers, png is listed first as the
+# default format.
+TILE_FORMATS = "\n".join(
+    TILE_FORMAT_TEMPLATE.format(content_type=content_type)
+    for content_type in const.TILE_FORMATS.values()
+)
+
+# The tile matrix set is the same for all documents, build it only once.
+TILE_MATRIX_SET = TILE_MATRIX_SET_TEMPLATE.format(
+    matrices="".join(
+        TILE_MATRIX_TEMPLATE.format(
+            zoom=zoom,
+            scale=const.SCALE_DENOMINATOR_ZOOM_0 / 2**zoom,
+            size=2**zoom,
+        )
+        for zoom in range(const.WMTS_MAX_ZOOM + 1)
+    )
+)
+
+
+def get_layer_dates(today, start="1980-01-01", stop=None):
     """
-    Generate WMTS xml string.
+    Get the first day of each month after the start date until today, or
+    until the first month after the stop date.
     """
-    xml = ""
-    current_year = datetime.date.today().year + 1
-    for year in range(1980, current_year):
+    start = datetime.date.fromisoformat(start)
+    if stop:
+        # The first day of the month after the stop date.
+        stop = datetime.date.fromisoformat(stop).replace(day=28)
+        stop = (stop + datetime.timedelta(days=4)).replace(day=1)
+        today = min(today, stop)
+    for year in range(start.year, today.year + 1):
         for month in range(1, 13):
             end = datetime.date(year=year, month=month, day=1)
-            print(end)
-            if end > datetime.datetime.now().date():
-                break
-            if platform:
-                title = f"Latest Pixel {platform.title()} {end.strftime('%Y %B')}"
-                url = LATEST_PIXEL_PLATFORM_URL_TEMPLATE.format(
-                    host=host,
-                    key=key,
-                    end=end,
-                    cloud=max_cloud_cover_percentage,
-                    platform=platform,
-                )
-            else:
-                title = "Latest Pixel " + end.strftime("%B %Y")
-                url = LATEST_PIXEL_URL_TEMPLATE.format(
-                    host=host,
-                    key=key,
-                    end=end,
-                    cloud=max_cloud_cover_percentage,
-                )
-            xml += TILE_LAYER_TEMPLATE.format(
+            if end <= start:
+                continue
+            if end > today:
+                return
+            yield end
+
+
+@lru_cache(maxsize=const.WMTS_CAPABILITIES_CACHE_SIZE)
+def gen_cached(host, max_cloud_cover_percentage, platform, month):
+    """
+    Generate the WMTS xml string with a placeholder for the user key.
+
+    The month argument is the first day of the current month, so that the
+    cached documents are rebuilt once a new monthly layer is available.
+    """
+    layers = []
+    # Only list the months with data of the platform.
+    for end in get_layer_dates(month, *platforms.get_platform_dates(platform)):
+        if platform:
+            title = f"Latest Pixel {platform.title()} {end.strftime('%Y %B')}"
+            url = LATEST_PIXEL_PLATFORM_URL_TEMPLATE.format(
+                host=host,
+                key=KEY_PLACEHOLDER,
+                end=end,
+                cloud=max_cloud_cover_percentage,
+                platform=platform,
+                extension="{extension}",
+            )
+        else:
+            title = "Latest Pixel " + end.strftime("%B %Y")
+            url = LATEST_PIXEL_URL_TEMPLATE.format(
+                host=host,
+                key=KEY_PLACEHOLDER,
+                end=end,
+                cloud=max_cloud_cover_percentage,
+                extension="{extension}",
+            )
+        resources = "\n".join(
+            TILE_RESOURCE_TEMPLATE.format(
+                content_type=content_type,
+                url=url.replace("{extension}", extension),
+            )
+            for extension, content_type in const.TILE_FORMATS.items()
+        )
+        layers.append(
+            TILE_LAYER_TEMPLATE.format(
                 title=title,
                 identifier=end.strftime("%Y%m"),
-                url=url,
+                formats=TILE_FORMATS,
+                resources=resources,
             )
+        )
 
     return WMTS_BASE_TEMPLATE.format(
         metadata_url="{}/wmts".format(host),
-        layers=xml,
-        mat=TILE_MATRIX_SET_TEMPLATE,
+        layers="".join(layers),
+        mat=TILE_MATRIX_SET,
     )
+
+
+def gen(key, host, max_cloud_cover_percentage=100, platform=None):
+    """
+    Generate WMTS xml string.
+    """
+    month = datetime.date.today().replace(day=1)
+    xml = gen_cached(host, str(max_cloud_cover_percentage), platform or "", month)
+    # Substitute the user key last, the rest of the document is shared.
+    return xml.replace(KEY_PLACEHOLDER, str(key))
@@ -20,11 +20,11 @@ apiurlpatterns = [
     path("wmts", wmtsview),
     path("wmts/<str:platform>", wmtsview),
     path(
-        "tiles/<int:z>/<int:x>/<int:y>.png",
+        "tiles/<int:z>/<int:x>/<int:y>.<str:frmt>",
         tilesview,
     ),
     path(
-        "tiles/<str:platform>/<int:z>/<int:x>/<int:y>.png",
+        "tiles/<str:platform>/<int:z>/<int:x>/<int:y>.<str:frmt>",
         tilesview,
     ),
 ]
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
+import json
 import logging
 import os
 import sys
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
     "batch",
     "pipeline",
     "tsuser",
+    "wmts",
 ]
 
 AUTHENTICATION_BACKENDS = [
@@ -184,6 +186,62 @@ else:
     AWS_S3_BUCKET_NAME_STATIC = os.getenv("AWS_STORAGE_BUCKET_NAME_STATIC")
     STATICFILES_STORAGE = "django_s3_storage.storage.StaticS3Storage"
 
+# Pixel type for raster algebra evaluation in tiles, float32 halves the memory
+# used compared to float64. Can be overridden per request.
+WMTS_ALGEBRA_PIXEL_TYPE = os.getenv("WMTS_ALGEBRA_PIXEL_TYPE", "float64")
+
+# Server side cache for rendered tiles. Tiles can be shared between workers
+# through a path on a shared file system, or by using the backend
+# "wmts.cache.DjangoTileCache" with a cache alias from the CACHES setting.
+# Workers sharing a path count its size from the files once per minute, the
+# cache can exceed its maximum size by the tiles written in between.
+# With a lock timeout in seconds, workers wait for each other instead of
+# rendering the same tiles concurrently.
+WMTS_TILE_CACHE = {
+    "BACKEND": "wmts.cache.DiskTileCache",
+    "OPTIONS": {
+        "path": os.getenv("WMTS_TILE_CACHE_PATH", "/tmp/tilecache"),
+        "max_size": int(os.getenv("WMTS_TILE_CACHE_MAX_SIZE", 256 * 1024**2)),
+        "lock_timeout": int(os.getenv("WMTS_TILE_CACHE_LOCK_TIMEOUT", 0)),
+    },
+}
+
+# Tile output formats. If negotiation is enabled, the png tile urls answer
+# with WebP for clients that accept it. The quality applies to WebP and JPEG
+# tiles and can be overridden per request.
+WMTS_TILE_NEGOTIATION = os.getenv("WMTS_TILE_NEGOTIATION", "True") == "True"
+WMTS_TILE_QUALITY = int(os.getenv("WMTS_TILE_QUALITY", 80))
+
+# Tiles share the cached scene search of their parent tile this many zoom
+# levels above, 0 disables shared searches. The results are stored in the cache
+# with the given alias from the CACHES setting.
+WMTS_SCENE_SEARCH_ZOOM_OFFSET = int(os.getenv("WMTS_SCENE_SEARCH_ZOOM_OFFSET", 2))
+WMTS_SCENE_SEARCH_CACHE = os.getenv("WMTS_SCENE_SEARCH_CACHE", "default")
+
+# Number of tiles along each side of the metatiles rendered for uncached
+# tiles of past dates, a power of two. All tiles of a metatile are fetched with
+# a single search and stored in the tile cache.
+WMTS_METATILE_SIZE = int(os.getenv("WMTS_METATILE_SIZE", 1))
+
+# Placeholder for tiles below the minimum zoom and tiles without data, one of
+# "image", "transparent" or "none" for empty 204 responses. Can be overridden
+# per request.
+WMTS_TILE_PLACEHOLDER = os.getenv("WMTS_TILE_PLACEHOLDER", "image")
+
+# Additional platforms for tiles by name, or changes to the default platforms
+# in wmts.const.PLATFORMS, as JSON. For instance
+# {"LANDSAT_9": {"start": "2021-10-31", "bands": ["B4", "B3", "B2"],
+# "scaling": 30000}}.
+WMTS_PLATFORMS = json.loads(os.getenv("WMTS_PLATFORMS", "{}"))
+
+# Cache alias from the CACHES setting for the percentile statistics of the
+# auto stretch of RGB tiles.
+WMTS_STRETCH_CACHE = os.getenv("WMTS_STRETCH_CACHE", "default")
+
+# Fraction of tile requests for which the durations of the rendering stages are
+# sent in a Server-Timing header and logged, from 0 to 1.
+WMTS_TIMING_SAMPLE_RATE = float(os.getenv("WMTS_TIMING_SAMPLE_RATE", 0))
+
 # Setup logging for django.
 LOGGING = {
     "version": 1,
@@ -219,6 +277,11 @@ LOGGING = {
             "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
             "propagate": False,
         },
+        "wmts": {
+            "handlers": ["console"],
+            "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
         "django": {
             "handlers": [],
             "level": "CRITICAL",
@@ -0,0 +1,56 @@
+import numpy
+from django.test import SimpleTestCase
+from wmts.algebra import colors
+
+
+class ColorizeTests(SimpleTestCase):
+    def test_continuous_colormap(self):
+        colormap = {
+            "continuous": "True",
+            "from": [0, 0, 0],
+            "to": [255, 255, 255],
+            "range": [0, 100],
+        }
+        data = numpy.array([[-10, 25, 50], [75, 99.9, 200]])
+        rgba, stats = colors.colorize(data, colormap)
+        self.assertEqual(rgba.shape, (2, 3, 4))
+        self.assertEqual(stats, {})
+        numpy.testing.assert_array_equal(rgba[..., 3], [[0, 255, 255], [255, 255, 0]])
+        numpy.testing.assert_allclose(
+            rgba[..., 0], [[0, 63, 127], [191, 254, 0]], atol=1
+        )
+
+    def test_continuous_lut_is_cached(self):
+        lut = colors.continuous_lut((0, 0, 0), (255, 255, 255), (None, None, None))
+        self.assertIs(
+            lut, colors.continuous_lut((0, 0, 0), (255, 255, 255), (None, None, None))
+        )
+        self.assertFalse(lut.flags.writeable)
+        numpy.testing.assert_array_equal(lut[-1], [0, 0, 0, 0])
+
+    def test_discrete_colormap(self):
+        colormap = {
+            "3": [0, 0, 255, 255],
+            "1": [255, 0, 0, 255],
+            "2.5": [0, 255, 0, 255],
+        }
+        data = numpy.ma.masked_array(
+            [[1, 1, 2.5], [3, 4, 3]], mask=[[False, False, False], [False, False, True]]
+        )
+        rgba, stats = colors.colorize(data, colormap)
+        numpy.testing.assert_array_equal(
+            rgba,
+            [
+                [[255, 0, 0, 255], [255, 0, 0, 255], [0, 255, 0, 255]],
+                [[0, 0, 255, 255], [0, 0, 0, 0], [0, 0, 0, 0]],
+            ],
+        )
+        self.assertEqual(list(stats.items()), [("3", 1), ("1", 2), ("2.5", 1)])
+
+    def test_discrete_integer_colormap(self):
+        colormap = {str(i): [i, i, i, 255] for i in range(40)}
+        data = numpy.array([[0, 39, 40], [-1, 12.5, 12]])
+        rgba, stats = colors.colorize(data, colormap)
+        numpy.testing.assert_array_equal(rgba[..., 0], [[0, 39, 0], [0, 0, 12]])
+        numpy.testing.assert_array_equal(rgba[..., 3], [[255, 255, 0], [0, 0, 255]])
+        self.assertEqual(sum(stats.values()), 3)
@@ -0,0 +1,146 @@
+from unittest import mock
+
+import numpy
+from django.test import SimpleTestCase
+from pixels.exceptions import PixelsException
+from rasterio.errors import RasterioIOError
+from rest_framework.exceptions import ValidationError
+from wmts import composite
+from wmts.views import parse_composite_parameters
+
+
+def read_scene(item, bands, bounds, shape):
+    """
+    Return scenes with constant values by band.
+    """
+    return numpy.array(
+        [numpy.full(shape, item["bands"][band], dtype="uint16") for band in bands]
+    )
+
+
+def read_scene_or_fail(item, bands, bounds, shape):
+    """
+    Fail to read scenes without bands.
+    """
+    if not item["bands"]:
+        raise RasterioIOError("Read failed.")
+    return read_scene(item, bands, bounds, shape)
+
+
+class CompositeTests(SimpleTestCase):
+    def test_percentile_reducer(self):
+        rng = numpy.random.default_rng(0)
+        scenes = rng.integers(0, 4, (7, 2, 5, 5)).astype("uint16")
+        reducer = composite.PercentileReducer((2, 5, 5), 30)
+        for scene in scenes:
+            reducer.add(scene.copy())
+        values = numpy.where(scenes == 0, numpy.nan, scenes)
+        expected = numpy.nan_to_num(numpy.nanpercentile(values, 30, axis=0))
+        numpy.testing.assert_array_equal(
+            reducer.result(), numpy.round(expected).astype("uint16")
+        )
+
+    def test_greenest_reducer(self):
+        reducer = composite.GreenestReducer((3, 1, 2), 0, 1)
+        reducer.add(numpy.array([[[100, 100]], [[200, 500]], [[7, 7]]], dtype="uint16"))
+        reducer.add(numpy.array([[[100, 100]], [[300, 300]], [[8, 0]]], dtype="uint16"))
+        # The second pixel of the greener scene has no data.
+        self.assertEqual(
+            reducer.result().tolist(), [[[100, 100]], [[300, 500]], [[8, 7]]]
+        )
+
+    @mock.patch("wmts.composite.read_scene", read_scene)
+    @mock.patch("wmts.const.COMPOSITE_WORKERS", 2)
+    def test_composite_pixels(self):
+        items = [{"bands": {"B04": value, "B08": 2 * value}} for value in range(1, 6)]
+        with mock.patch("wmts.search.search_data", return_value=items):
+            args, stack = composite.composite_pixels(
+                {},
+                (0, 0, 1, 1),
+                (2, 2),
+                "2020-01-01",
+                "2021-01-01",
+                ["B04"],
+                [],
+                "median",
+            )
+            self.assertEqual(stack.tolist(), [[[3, 3], [3, 3]]])
+            args, stack = composite.composite_pixels(
+                {},
+                (0, 0, 1, 1),
+                (2, 2),
+                "2020-01-01",
+                "2021-01-01",
+                ["B04"],
+                [],
+                "greenest",
+                red="B04",
+                nir="B08",
+            )
+            self.assertEqual(stack.shape, (1, 2, 2))
+        with mock.patch("wmts.search.search_data", return_value=[]):
+            args, stack = composite.composite_pixels(
+                {},
+                (0, 0, 1, 1),
+                (2, 2),
+                "2020-01-01",
+                "2021-01-01",
+                ["B04"],
+                [],
+                "median",
+            )
+            self.assertIsNone(stack)
+
+    @mock.patch("wmts.composite.read_scene", read_scene_or_fail)
+    def test_failed_scenes_are_skipped(self):
+        items = [{"bands": {}}, {"bands": {"B04": 3}}, {"bands": {}}]
+        arguments = ({}, (0, 0, 1, 1), (2, 2), "2020-01-01", "2021-01-01", ["B04"])
+        with mock.patch("wmts.search.search_data", return_value=items):
+            args, stack = composite.composite_pixels(*arguments, [], "median")
+            self.assertEqual(stack.tolist(), [[[3, 3], [3, 3]]])
+        # Composites without any readable scene have no pixels.
+        with mock.patch("wmts.search.search_data", return_value=items[::2]):
+            args, stack = composite.composite_pixels(*arguments, [], "median")
+            self.assertIsNone(stack)
+
+    def test_missing_scene_search(self):
+        with mock.patch("wmts.search.pixels_search_data", None):
+            with self.assertRaises(PixelsException):
+                composite.composite_pixels(
+                    {},
+                    (0, 0, 1, 1),
+                    (2, 2),
+                    "2020-01-01",
+                    "2021-01-01",
+                    [],
+                    [],
+                    "median",
+                )
+            with self.assertRaises(ValidationError):
+                parse_composite_parameters(
+                    {"composite": "median", "start": "2020-01-01"}, "", "2021-01-01"
+                )
+
+    @mock.patch("wmts.const.COMPOSITE_MAX_BYTES", 5 * 2 * 2 * 4)
+    def test_percentile_scenes_are_capped(self):
+        reducer = composite.PercentileReducer((2, 2, 2), 50, max_scenes=3)
+        for value in (1, 2, 3, 4, 5):
+            reducer.add(numpy.full((2, 2, 2), value, dtype="uint16"))
+        self.assertEqual(len(reducer.scenes), 3)
+        self.assertEqual(reducer.result().max(), 2)
+        # The number of scenes is bounded by the memory budget.
+        self.assertEqual(composite.PercentileReducer.get_max_scenes((2, 2, 2)), 5)
+        self.assertEqual(composite.PercentileReducer.get_max_scenes((2, 8, 8)), 1)
+        self.assertEqual(composite.PercentileReducer.get_max_scenes((1, 1, 1)), 20)
+        with mock.patch("wmts.search.search_data", return_value=[]) as search:
+            composite.composite_pixels(
+                {},
+                (0, 0, 1, 1),
+                (2, 2),
+                "2020-01-01",
+                "2021-01-01",
+                ["B04"],
+                [],
+                "median",
+            )
+        self.assertEqual(search.call_args.kwargs["limit"], 10)
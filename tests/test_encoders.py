@@ -0,0 +1,47 @@
+import io
+import warnings
+
+import numpy
+from django.test import SimpleTestCase
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+from wmts.encoders import encode, encode_png
+
+
+class PngEncoderTests(SimpleTestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.img = rng.integers(0, 256, (4, 32, 16)).astype("uint8")
+
+    def read(self, png):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with MemoryFile(png) as memfile, memfile.open() as dst:
+                return dst.read()
+
+    def test_encode_png_filters(self):
+        for bands in (1, 3, 4):
+            for filter_type in ("none", "sub", "up"):
+                png = encode_png(self.img[:bands], filter_type=filter_type)
+                numpy.testing.assert_array_equal(self.read(png), self.img[:bands])
+
+    def test_encode_png_output(self):
+        out = io.BytesIO()
+        self.assertIsNone(encode_png(self.img, out=out))
+        self.assertEqual(out.getvalue(), encode_png(self.img))
+
+    def test_encode_png_nodata(self):
+        png = encode_png(self.img[:3], nodata=0)
+        self.assertIn(b"tRNS\x00\x00\x00\x00\x00\x00", png)
+
+    def test_encode_png_invalid(self):
+        with self.assertRaises(ValueError):
+            encode_png(self.img.astype("uint16"))
+
+    def test_encode_lossy_formats(self):
+        self.assertTrue(encode(self.img, "webp", quality=50).startswith(b"RIFF"))
+        jpeg = encode(self.img, "jpg", quality=50)
+        self.assertTrue(jpeg.startswith(b"\xff\xd8"))
+        self.assertEqual(self.read(jpeg).shape, (3, 32, 16))
+        with self.assertRaises(ValueError):
+            encode(self.img, "gif")
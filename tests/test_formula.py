@@ -0,0 +1,122 @@
+import numpy
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ValidationError
+from wmts.algebra import parser
+from wmts.views import parse_tile_parameters
+
+
+class FormulaCompilationTests(SimpleTestCase):
+    def setUp(self):
+        parser._compile_normalized_formula.cache_clear()
+
+    def test_compile_formula_is_cached(self):
+        compiled = parser.compile_formula("(B08 - B04) / (B08 + B04)")
+        # Whitespace does not create a new cache entry.
+        self.assertIs(compiled, parser.compile_formula("(B08-B04)/(B08+B04)"))
+        self.assertEqual(parser._compile_normalized_formula.cache_info().misses, 1)
+        self.assertEqual(compiled.formula, "(B08-B04)/(B08+B04)")
+        self.assertEqual(compiled.program, ("B08", "B04", "-", "B08", "B04", "+", "/"))
+
+    def test_evaluate_with_compiled_formula(self):
+        stack = numpy.array([[[1, 2], [3, 4]], [[1, 1], [1, 1]]])
+        for i in range(2):
+            ndvi = parser.evaluate(
+                "(B01 + 2 * B02) / (B01 + B02)", ["B01", "B02"], stack
+            )
+            expected = [[1.5, 4 / 3], [5 / 4, 6 / 5]]
+            numpy.testing.assert_array_almost_equal(ndvi, expected)
+        self.assertEqual(parser._compile_normalized_formula.cache_info().hits, 1)
+
+    def test_empty_formula(self):
+        with self.assertRaises(parser.RasterAlgebraException):
+            parser.compile_formula("")
+
+
+class RegisterEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.bands = ["B08", "B04", "B02"]
+        self.stack = numpy.arange(3 * 4 * 4).reshape(3, 4, 4) + 1
+
+    def test_register_engine_matches_stack_engine(self):
+        for formula in [
+            "(B08 - B04) / (B08 + B04 + 0.5) * 1.5",
+            "-B04 + sin(B02) ^ 2",
+            "(B08 > B04) & (B02 < 40)",
+            "max(B08) - B04",
+            "int(B08 / 3) + round(B04 / 7)",
+            "B08 == NULL",
+            "2 * PI / 4",
+        ]:
+            expected = parser.evaluate(formula, self.bands, self.stack, "stack")
+            result = parser.evaluate(formula, self.bands, self.stack, "register")
+            numpy.testing.assert_array_almost_equal(result, expected)
+
+    def test_register_allocation(self):
+        compiled = parser.compile_formula("(B08-B04)/(B08+B04+0.5)*1.5")
+        # Five operators run on two scratch buffers.
+        self.assertEqual(len(compiled.registers.instructions), 5)
+        self.assertEqual(compiled.registers.registers, 2)
+        self.assertEqual(
+            compiled.registers.expression,
+            "(((B08 - B04) / ((B08 + B04) + 0.5)) * 1.5)",
+        )
+
+    def test_undeclared_variable(self):
+        with self.assertRaises(parser.RasterAlgebraException):
+            parser.evaluate("B08 + B05", self.bands, self.stack)
+
+    def test_float32_pixel_type(self):
+        stack = self.stack.astype("uint16")
+        for engine in ("stack", "register"):
+            result = parser.evaluate(
+                "(B08 - B04) / (B08 + B04) * 1.5",
+                self.bands,
+                stack,
+                engine,
+                dtype=numpy.float32,
+            )
+            self.assertEqual(result.dtype, numpy.float32)
+
+    def test_no_copy_for_target_pixel_type(self):
+        band = numpy.ones((4, 4), dtype="float32")
+        data = {"B08": band}
+        parser.FormulaParser().evaluate(data, "B08 * 2", dtype=numpy.float32)
+        self.assertIs(data["B08"], band)
+
+
+class FormulaOptimizationTests(SimpleTestCase):
+    def test_constant_folding(self):
+        compiled = parser.compile_formula("B08 * 2 * PI / 4")
+        self.assertEqual(compiled.program, ("B08", "2", "*", "PI", "*", "4", "/"))
+        compiled = parser.compile_formula("B08 * (2 * PI / 4)")
+        self.assertEqual(compiled.program, ("B08", repr(numpy.pi / 2), "*"))
+        # Boolean results are not folded.
+        compiled = parser.compile_formula("B08 + (1 > 0)")
+        self.assertEqual(compiled.program, ("B08", "1", "0", ">", "+"))
+
+    def test_common_subexpressions(self):
+        compiled = parser.compile_formula("(B08 - B04) / (B08 + B04) + (B08 - B04)")
+        ops = [instruction.op for instruction in compiled.registers.instructions]
+        self.assertEqual(ops, ["-", "+", "/", "+"])
+        stack = numpy.array([[[3.0, 4.0]], [[1.0, 2.0]]])
+        result = parser.evaluate(
+            "(B08 - B04) / (B08 + B04) + (B08 - B04)", ["B08", "B04"], stack
+        )
+        numpy.testing.assert_array_almost_equal(result, [[2.5, 2 + 1 / 3]])
+
+    def test_variables(self):
+        compiled = parser.compile_formula("(B12 - B1) / (B12 + B1) * sin(PI) + B8A")
+        self.assertEqual(compiled.variables, frozenset(["B1", "B12", "B8A"]))
+        self.assertEqual(parser.compile_formula("2 * PI").variables, frozenset())
+
+    def test_parse_error(self):
+        with self.assertRaises(parser.RasterAlgebraException):
+            parser.compile_formula("*B08")
+
+    def test_trailing_input_is_rejected(self):
+        for formula in ("B1+", "B04*2)", "(B04 - B08) / 2 B02"):
+            with self.assertRaises(parser.RasterAlgebraException):
+                parser.compile_formula(formula)
+            # Tile requests with invalid formulas are rejected.
+            with self.assertRaises(ValidationError):
+                parse_tile_parameters({"formula": formula, "end": "2021-01-01"})
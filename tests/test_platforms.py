@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase, override_settings
+from wmts import platforms
+
+
+class PlatformRegistryTests(SimpleTestCase):
+    def setUp(self):
+        platforms.get_registry.cache_clear()
+
+    def tearDown(self):
+        platforms.get_registry.cache_clear()
+
+    def test_resolve_default_platforms(self):
+        for end, names, scaling in (
+            ("1999-12-31", ["LANDSAT_4", "LANDSAT_5"], 100),
+            ("2000-01-01", ["LANDSAT_7"], 255),
+            ("2017-12-31", ["LANDSAT_8"], 30000),
+            ("2018-01-01", ["SENTINEL_2"], 4000),
+        ):
+            config = platforms.resolve_platform("", end)
+            self.assertEqual(config["platforms"], names)
+            self.assertEqual(config["scaling"], scaling)
+
+    def test_resolve_platform(self):
+        config = platforms.resolve_platform("sentinel-2", "2010-01-01")
+        self.assertEqual(
+            config,
+            {
+                "platforms": ["SENTINEL_2"],
+                "bands": ["B04", "B03", "B02"],
+                "red": "B04",
+                "nir": "B08",
+                "scaling": 4000,
+                "level": "L2A",
+            },
+        )
+        self.assertFalse(platforms.is_platform("landsat-1"))
+
+    @override_settings(
+        WMTS_PLATFORMS={
+            "landsat-9": {"start": "2021-10-31", "bands": ["B4"], "scaling": 300},
+            "SENTINEL_2": {"scaling": 3000},
+        }
+    )
+    def test_platforms_setting(self):
+        self.assertEqual(platforms.resolve_platform("LANDSAT_9", "")["bands"], ["B4"])
+        self.assertEqual(platforms.resolve_platform("", "2021")["scaling"], 3000)
+        self.assertEqual(
+            platforms.get_platform_dates("landsat-9"), ("2021-10-31", None)
+        )
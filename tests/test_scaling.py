@@ -0,0 +1,35 @@
+import numpy
+from django.test import SimpleTestCase
+from wmts.scaling import scale_to_uint8
+
+
+class ScalingTests(SimpleTestCase):
+    def test_scale_matches_float_scaling(self):
+        stack = numpy.arange(65536, dtype="uint16").reshape(1, 256, 256)
+        for scaling in (100, 255, 30000, 4000):
+            expected = (255 * (numpy.clip(stack, 0, scaling) / scaling)).astype("uint8")
+            numpy.testing.assert_array_equal(
+                scale_to_uint8(stack, 0, scaling), expected
+            )
+
+    def test_scale_per_band(self):
+        stack = numpy.array([[[0, 1000, 2000, 4000]]] * 2, dtype="uint16")
+        img = scale_to_uint8(stack, [0, 1000], [4000, 2000], gamma=[None, 2])
+        self.assertEqual(img.dtype, numpy.uint8)
+        self.assertEqual(img.tolist(), [[[0, 63, 127, 255]], [[0, 0, 255, 255]]])
+
+    def test_scale_invalid_stretch(self):
+        with self.assertRaises(ValueError):
+            scale_to_uint8(numpy.zeros((3, 2, 2)), [0, 0], 255)
+        with self.assertRaises(ValueError):
+            scale_to_uint8(numpy.zeros((3, 2, 2)), 10, 10)
+
+    def test_scale_keeps_valid_pixels_below_vmin(self):
+        stack = numpy.array([[[0, 800, 800, 3000]]] * 3, dtype="uint16")
+        stack[0, 0, 2] = 0
+        img = scale_to_uint8(stack, 1000, 4000, nodata=0)
+        # Only the nodata pixel is zero in all bands.
+        self.assertEqual(img[:, 0, 0].tolist(), [0, 0, 0])
+        self.assertEqual(img[:, 0, 1].tolist(), [1, 1, 1])
+        self.assertEqual(img[:, 0, 2].tolist(), [1, 1, 1])
+        self.assertEqual(img[:, 0, 3].tolist(), [170, 170, 170])
@@ -0,0 +1,80 @@
+from unittest import mock
+
+import mercantile
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from pixels import mosaic
+from wmts import search
+from wmts.search import get_search_tile, search_data, shared_scene_search
+from wmts.tiles import tile_geojson
+
+
+@override_settings(WMTS_SCENE_SEARCH_ZOOM_OFFSET=2, WMTS_SCENE_SEARCH_CACHE="default")
+class SharedSceneSearchTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        self.items = ["scene"]
+
+    def pixels_search_data(self, geojson, end=None, limit=10):
+        self.calls.append((geojson, end, limit))
+        return self.items
+
+    def test_get_search_tile(self):
+        self.assertEqual(get_search_tile(12, 2001, 1503), (500, 375, 10))
+        self.assertEqual(get_search_tile(12, 2000, 1500, size=4), (125, 93, 8))
+        self.assertEqual(get_search_tile(1, 1, 1), (0, 0, 0))
+        with self.settings(WMTS_SCENE_SEARCH_ZOOM_OFFSET=0):
+            self.assertIsNone(get_search_tile(12, 2001, 1503))
+
+    def test_shared_search(self):
+        child = tile_geojson(12, 2000, 1500)
+        with mock.patch("wmts.search.pixels_search_data", self.pixels_search_data):
+            for x in (2000, 2001, 2002, 2003):
+                tile = get_search_tile(12, x, 1500)
+                with shared_scene_search(tile, "parent"):
+                    items = search_data(child, end="2021-01-01", limit=10)
+                self.assertEqual(items, ["scene"])
+            # Searches outside of tile rendering are not changed.
+            search_data(child, end="2021-01-01")
+        self.assertEqual(
+            self.calls, [("parent", "2021-01-01", 40), (child, "2021-01-01", 10)]
+        )
+
+    def test_search_arguments_in_key(self):
+        child = tile_geojson(12, 2000, 1500)
+        with mock.patch("wmts.search.pixels_search_data", self.pixels_search_data):
+            with shared_scene_search(get_search_tile(12, 2000, 1500), "parent"):
+                search_data(child, end="2021-01-01")
+                search_data(child, end="2021-02-01")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_scenes_intersect_child(self):
+        west, south, east, north = mercantile.bounds(2000, 1500, 12)
+        inside = {"bbox": [west, south, east, north]}
+        outside = {"bbox": [east + 1, south, east + 2, north]}
+        polygon = {
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": [[[[west, south], [east, south], [east, north]]]],
+            }
+        }
+        self.items = [outside, inside, "scene", outside, polygon, inside]
+        child = tile_geojson(12, 2000, 1500)
+        with mock.patch("wmts.search.pixels_search_data", self.pixels_search_data):
+            with shared_scene_search(get_search_tile(12, 2000, 1500), "parent"):
+                items = search_data(child, end="2021-01-01", limit=3)
+        # Scenes outside of the child tile are skipped, up to the limit.
+        self.assertEqual(items, [inside, "scene", polygon])
+
+    def test_search_routed_while_rendering(self):
+        original = mosaic.search_data
+        tile = get_search_tile(12, 2000, 1500)
+        with shared_scene_search(tile, "parent"):
+            self.assertIs(mosaic.search_data, search.search_data)
+            with shared_scene_search(tile, "parent"):
+                pass
+            self.assertIs(mosaic.search_data, search.search_data)
+        self.assertIs(mosaic.search_data, original)
+        with shared_scene_search(None, None):
+            self.assertIs(mosaic.search_data, original)
@@ -0,0 +1,38 @@
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from wmts.management.commands.seedtiles import get_aoi_tiles
+
+AOI = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {},
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [-4.0, 43.0],
+                        [-3.9, 43.0],
+                        [-3.9, 43.1],
+                        [-4.0, 43.1],
+                        [-4.0, 43.0],
+                    ]
+                ],
+            },
+        }
+    ],
+}
+
+
+class SeedTilesTests(SimpleTestCase):
+    def test_get_aoi_tiles(self):
+        tiles = get_aoi_tiles(AOI, [12, 13])
+        self.assertEqual(len(tiles), 22)
+        self.assertEqual(len(set(tiles)), len(tiles))
+        self.assertEqual(tiles[0], (2002, 1503, 12))
+        self.assertEqual(tiles, get_aoi_tiles(AOI["features"][0], [12, 13]))
+
+    def test_invalid_zoom(self):
+        with self.assertRaises(CommandError):
+            call_command("seedtiles", "aoi.json", "--zoom", "3", "13", "--end", "2020")
@@ -0,0 +1,90 @@
+import threading
+import time
+from unittest import mock
+
+import mercantile
+import numpy
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from wmts import stretch
+from wmts.views import parse_stretch_parameters, parse_tile_parameters
+
+
+@override_settings(WMTS_STRETCH_CACHE="default")
+class StretchTests(SimpleTestCase):
+    def test_percentiles(self):
+        stack = numpy.array([numpy.arange(101), numpy.arange(101) * 2])
+        stack[:, :10] = 0
+        vmin, vmax = stretch.percentiles(stack, nodata=0)
+        self.assertEqual(vmin, [11.8, 23.6])
+        self.assertEqual(vmax, [98.2, 196.4])
+        self.assertIsNone(stretch.percentiles(numpy.zeros((3, 4, 4)), nodata=0))
+
+    def test_get_stretch_tile(self):
+        tile = stretch.get_stretch_tile(12, 2001, 1503)
+        self.assertEqual(tile, mercantile.Tile(250, 187, 9))
+        self.assertEqual(stretch.get_stretch_tile(1, 1, 1), mercantile.Tile(0, 0, 0))
+
+    def test_stretch_is_cached(self):
+        tile = mercantile.Tile(250, 187, 9)
+        read = mock.Mock(return_value=({}, numpy.ones((3, 4, 4))))
+        expected = ([1.0] * 3, [2.0] * 3)
+        for i in range(2):
+            result = stretch.get_percentile_stretch(tile, read, end="2020-01-01")
+            self.assertEqual(result, expected)
+        read.assert_called_once()
+        # Tiles without pixels are cached too.
+        read = mock.Mock(return_value=({}, None))
+        for i in range(2):
+            self.assertIsNone(stretch.get_percentile_stretch(tile, read, end="2000"))
+        read.assert_called_once()
+
+    def test_concurrent_stretch_reads_parent_once(self):
+        tile = mercantile.Tile(250, 187, 9)
+
+        def read():
+            time.sleep(0.1)
+            return {}, numpy.ones((3, 4, 4))
+
+        read = mock.Mock(side_effect=read)
+        results = []
+
+        def get_stretch():
+            results.append(stretch.get_percentile_stretch(tile, read, end="2019-01-01"))
+
+        threads = [threading.Thread(target=get_stretch) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        read.assert_called_once()
+        self.assertEqual(results, [([1.0] * 3, [2.0] * 3)] * 8)
+
+    def test_parse_stretch_parameters(self):
+        query = {"stretch": "auto", "vmin": "0", "vmax": "10,20,30", "gamma": "1.5"}
+        self.assertEqual(
+            parse_stretch_parameters(query, 3, 4000),
+            {"stretch_mode": "auto", "vmin": 0, "vmax": [10, 20, 30], "gamma": 1.5},
+        )
+        self.assertEqual(parse_stretch_parameters({}, 3, 4000), {})
+        for query in (
+            {"stretch": "linear"},
+            {"vmin": "0,1"},
+            {"vmax": "a"},
+            {"gamma": "0"},
+            {"vmin": "10", "vmax": "20,5,30"},
+            {"vmin": "5000"},
+            {"vmax": "-5"},
+            {"vmax": "nan"},
+            {"vmin": "inf"},
+            {"gamma": "nan"},
+        ):
+            with self.assertRaises(ValidationError):
+                parse_stretch_parameters(query, 3, 4000)
+
+    def test_stretch_defaults_of_platform(self):
+        query = {"end": "2021-01-01", "vmin": "5000"}
+        with self.assertRaises(ValidationError):
+            parse_tile_parameters(query, "sentinel-2")
+        params = parse_tile_parameters(query, "landsat-8")
+        self.assertEqual(params["vmin"], 5000)
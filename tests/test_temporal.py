@@ -0,0 +1,82 @@
+from unittest import mock
+
+import numpy
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ValidationError
+from wmts import tiles
+from wmts.algebra import parser
+from wmts.views import parse_temporal_parameters
+
+
+class TemporalTests(SimpleTestCase):
+    def setUp(self):
+        # Two pixels over three dates, the second pixel has no data on the
+        # first date.
+        self.red = numpy.array([[[1.0, numpy.nan]], [[3.0, 4.0]], [[5.0, 8.0]]])
+        self.nir = self.red * 2
+
+    def test_temporal_functions(self):
+        data = {"B04": self.red}
+        for formula, expected in (
+            ("tmean(B04)", [[3, 6]]),
+            ("tmin(B04)", [[1, 4]]),
+            ("tmax(B04)", [[5, 8]]),
+            ("tsum(B04)", [[9, 12]]),
+            ("tfirst(B04)", [[1, 4]]),
+            ("tlast(B04)", [[5, 8]]),
+            ("tdiff(B04)", [[4, 4]]),
+        ):
+            result = parser.FormulaParser().evaluate(data, formula)
+            self.assertEqual(result.tolist(), expected, formula)
+
+    def test_evaluate_over_dates(self):
+        # Band arithmetic is evaluated for all dates before the reduction.
+        result = parser.evaluate(
+            "tmax((B08 - B04) / (B08 + B04)) - tmin(B04 / 2)",
+            ["B04", "B08"],
+            numpy.array([self.red, self.nir]),
+        )
+        numpy.testing.assert_allclose(result, [[1 / 3 - 0.5, 1 / 3 - 2]])
+        # Pixels without data on all dates are NaN.
+        result = parser.evaluate(
+            "tmean(B04)", ["B04"], numpy.full((1, 2, 1, 1), numpy.nan)
+        )
+        self.assertTrue(numpy.isnan(result).all())
+
+    def test_read_time_series(self):
+        def first_valid_pixel(geojson, end, scale, **kwargs):
+            if end == "2020-02-01":
+                return {}, None, None
+            stack = numpy.full((1, 256, 256), 4, dtype="uint16")
+            stack[0, 0, 0] = 0
+            return {"nodata": 0}, end, stack
+
+        with mock.patch("wmts.tiles.first_valid_pixel", first_valid_pixel):
+            args, stack = tiles.read_time_series(
+                14, 0, 0, 1, ["2020-01-01", "2020-02-01"], 1, "float32", bands=["B04"]
+            )
+        self.assertEqual(stack.shape, (1, 2, 256, 256))
+        self.assertEqual(stack.dtype, numpy.float32)
+        self.assertTrue(numpy.isnan(stack[0, 0, 0, 0]))
+        self.assertEqual(stack[0, 0, 1, 1], 4)
+        self.assertTrue(numpy.isnan(stack[0, 1]).all())
+
+    def test_parse_temporal_parameters(self):
+        query = {"dates": "2020-03-01,2020-01-01"}
+        self.assertEqual(
+            parse_temporal_parameters(query, "tmean(B04) - tfirst(B04)"),
+            {"end": "2020-03-01", "dates": ["2020-01-01", "2020-03-01"]},
+        )
+        self.assertEqual(parse_temporal_parameters({}, "B04 + 1"), {})
+        for query, formula in (
+            ({}, "tmean(B04)"),
+            (query, None),
+            (query, "B04 + 1"),
+            (query, "tmean(tmean(B04))"),
+            (query, "tmean(2)"),
+            ({"dates": "2020-01-01"}, "tmean(B04)"),
+            ({"dates": "2020-01-01,2020"}, "tmean(B04)"),
+            (dict(query, composite="median"), "tmean(B04)"),
+        ):
+            with self.assertRaises(ValidationError):
+                parse_temporal_parameters(query, formula)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from wmts.cache import DiskTileCache, SingleFlight, tile_cache_key
+
+
+class TileCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskTileCache(self.tmp.name, max_size=100, cull_fraction=0.4)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache_key(self):
+        key = tile_cache_key(10, 1, 2, end="2021-01-01", bands=["B04", "B03"])
+        self.assertEqual(
+            key, tile_cache_key(10, 1, 2, bands=["B04", "B03"], end="2021-01-01")
+        )
+        self.assertNotEqual(
+            key, tile_cache_key(10, 1, 3, end="2021-01-01", bands=["B04", "B03"])
+        )
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("abc"))
+        self.cache.set("abc", b"png")
+        self.assertEqual(self.cache.get("abc"), b"png")
+
+    def test_lru_eviction(self):
+        for i, key in enumerate(["aa1", "bb2", "cc3"]):
+            self.cache.set(key, b"x" * 30)
+            os.utime(self.cache.get_path(key), (i, i))
+        # Reading a tile marks it as recently used.
+        self.cache.get("aa1")
+        self.cache.set("dd4", b"x" * 30)
+        self.assertIsNotNone(self.cache.get("aa1"))
+        self.assertIsNone(self.cache.get("bb2"))
+        self.assertIsNone(self.cache.get("cc3"))
+        self.assertIsNotNone(self.cache.get("dd4"))
+        self.assertEqual(self.cache.size, 60)
+
+    def test_concurrent_sets(self):
+        cache = DiskTileCache(self.tmp.name, max_size=10**6)
+
+        def write(thread):
+            for i in range(50):
+                cache.set("{:02d}{}".format(i, thread), b"x" * 10)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.size, 8 * 50 * 10)
+        self.assertEqual(cache.size, sum(entry[2] for entry in cache.entries()))
+
+    def test_shared_path_size(self):
+        # Another worker writing to the same path.
+        other = DiskTileCache(self.tmp.name, max_size=100, cull_fraction=0.4)
+        for i, (cache, key) in enumerate(
+            [(self.cache, "aa1"), (other, "bb2"), (other, "cc3")]
+        ):
+            cache.set(key, b"x" * 30)
+            os.utime(self.cache.get_path(key), (i, i))
+        # Without a scan, only the own writes are counted.
+        self.cache.set("dd4", b"x" * 5)
+        self.assertEqual(self.cache.size, 35)
+        self.assertIsNotNone(self.cache.get("bb2"))
+        # Scanning the files includes the tiles of the other worker.
+        with mock.patch("wmts.const.TILE_CACHE_SCAN_INTERVAL", 0):
+            self.cache.set("ee5", b"x" * 30)
+        self.assertIsNone(other.get("cc3"))
+        self.assertIsNotNone(other.get("ee5"))
+        self.assertEqual(self.cache.size, sum(entry[2] for entry in other.entries()))
+        self.assertLessEqual(self.cache.size, 60)
+
+    def test_lock(self):
+        self.cache.lock_timeout = 60
+        self.assertTrue(self.cache.acquire("abc"))
+        self.assertFalse(self.cache.acquire("abc"))
+        self.cache.release("abc")
+        with self.cache.lock("abc"):
+            self.assertFalse(self.cache.acquire("abc"))
+        self.assertTrue(self.cache.acquire("abc"))
+        # Lock files are not cache entries.
+        self.assertEqual(list(self.cache.entries()), [])
+
+    def test_stale_lock(self):
+        self.cache.lock_timeout = 60
+        self.assertTrue(self.cache.acquire("abc"))
+        os.utime(self.cache.get_lock_path("abc"), (0, 0))
+        self.assertFalse(self.cache.acquire("abc"))
+        self.assertTrue(self.cache.acquire("abc"))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def render(value):
+            calls.append(value)
+            started.set()
+            time.sleep(0.2)
+            return value
+
+        results = []
+
+        def request():
+            results.append(flight.do("key", render, len(results)))
+
+        threads = [threading.Thread(target=request)]
+        threads[0].start()
+        started.wait()
+        threads += [threading.Thread(target=request) for i in range(3)]
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [0])
+        self.assertEqual(results, [0, 0, 0, 0])
+        # Later calls are executed again.
+        self.assertEqual(flight.do("key", render, 1), 1)
+
+    def test_exceptions_are_raised(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", int, "a")
+        self.assertEqual(flight.calls, {})
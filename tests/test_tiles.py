@@ -0,0 +1,128 @@
+import tempfile
+from unittest import mock
+
+import mercantile
+import numpy
+from django.test import SimpleTestCase
+from wmts.cache import DiskTileCache, tile_cache_key
+from wmts.encoders import decode, encode_png
+from wmts.tiles import get_metatile, render_metatile, render_overview, render_tile
+from wmts.views import (
+    parse_tile_parameters,
+    render_cached_overview,
+    render_current_overview,
+)
+
+
+def first_valid_pixel(geojson, end, scale, bands=None, **kwargs):
+    """
+    Return pixels that depend on their web mercator coordinates only.
+    """
+    coords = geojson["features"][0]["geometry"]["coordinates"][0]
+    xmin, ymin, xmax, ymax = coords[0][0], coords[0][1], coords[2][0], coords[2][1]
+    width = int(round((xmax - xmin) / scale))
+    height = int(round((ymax - ymin) / scale))
+    rows, cols = numpy.mgrid[0:height, 0:width]
+    x = xmin + cols * scale
+    y = ymax - rows * scale
+    values = (numpy.abs(x) + 3 * numpy.abs(y)) / scale % 4000
+    stack = numpy.array([values + band for band in range(len(bands))])
+    return {"width": width, "height": height}, end, stack.astype("uint16")
+
+
+@mock.patch("wmts.tiles.first_valid_pixel", first_valid_pixel)
+class MetatileTests(SimpleTestCase):
+    def test_get_metatile(self):
+        self.assertEqual(get_metatile(12, 2001, 1503, 4), (2000, 1500, 4))
+        self.assertEqual(get_metatile(1, 1, 0, 4), (0, 0, 2))
+
+    def test_render_metatile(self):
+        tiles = render_metatile(12, 2001, 1503, "2021-01-01", size=2)
+        self.assertEqual(
+            sorted(tiles), [(2000, 1502), (2000, 1503), (2001, 1502), (2001, 1503)]
+        )
+        for (x, y), data in tiles.items():
+            self.assertEqual(data, render_tile(12, x, y, "2021-01-01"))
+
+    def test_valid_pixels_below_vmin_are_opaque(self):
+        def dark_pixels(geojson, end, scale, bands=None, **kwargs):
+            stack = numpy.full((len(bands), 256, 256), 800, dtype="uint16")
+            stack[:, :10] = 0
+            return {"nodata": 0}, end, stack
+
+        with mock.patch("wmts.tiles.first_valid_pixel", dark_pixels):
+            img, nodata = decode(render_tile(12, 2001, 1503, "2021-01-01", vmin=1000))
+        transparent = (img == nodata).all(axis=0)
+        self.assertEqual(transparent.sum(), 10 * 256)
+        self.assertTrue(transparent[:10].all())
+
+
+class OverviewTests(SimpleTestCase):
+    def test_render_overview(self):
+        img = numpy.zeros((3, 256, 256), dtype="uint8")
+        img[:, :, ::2] = 100
+        children = {
+            (0, 0): encode_png(img),
+            (1, 0): encode_png(img + 50),
+            (0, 1): encode_png(img),
+            (1, 1): None,
+        }
+        overview, nodata = decode(render_overview(children))
+        self.assertEqual(overview.shape, (4, 256, 256))
+        # Pixels are averaged, missing children are transparent.
+        self.assertEqual(overview[0, 0, 0], 50)
+        self.assertEqual(overview[0, 0, 128], 100)
+        self.assertEqual(overview[3, 0, 0], 255)
+        self.assertEqual(overview[3, 255, 255], 0)
+
+    def test_render_overview_ignores_nodata(self):
+        # Every other pixel of the RGB children is nodata.
+        img = numpy.zeros((3, 256, 256), dtype="uint8")
+        img[:, :, ::2] = 200
+        data = encode_png(img, nodata=0)
+        children = {(0, 0): data, (1, 0): data, (0, 1): data, (1, 1): data}
+        overview, nodata = decode(render_overview(children))
+        self.assertEqual(overview.shape, (3, 256, 256))
+        self.assertEqual(nodata, 0)
+        self.assertTrue((overview == 200).all())
+        # Transparent pixels of RGBA children do not darken the average.
+        img = numpy.zeros((4, 256, 256), dtype="uint8")
+        img[:, :, ::2] = 200
+        children = {(0, 0): encode_png(img)}
+        overview, nodata = decode(render_overview(children))
+        self.assertEqual(overview[:, 0, 0].tolist(), [200, 200, 200, 100])
+        self.assertEqual(overview[:, 255, 255].tolist(), [0, 0, 0, 0])
+
+    def test_render_overview_empty(self):
+        self.assertIsNone(render_overview({(0, 0): None, (1, 0): None}))
+
+    def test_render_cached_overview(self):
+        params = parse_tile_parameters({"end": "2021-01-01"}, "sentinel-2")
+        read = mock.Mock(side_effect=first_valid_pixel)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch(
+            "wmts.tiles.first_valid_pixel", read
+        ):
+            cache = DiskTileCache(tmp, max_size=10**8)
+            with mock.patch("wmts.views.get_tile_cache", return_value=cache):
+                # Overviews below the on demand zoom require cached children.
+                self.assertIsNone(render_cached_overview(8, 125, 93, params))
+                # Overviews above the pixel tiles render their children in a
+                # single read.
+                data = render_cached_overview(9, 250, 187, params)
+                self.assertIsNotNone(data)
+                read.assert_called_once()
+                tiles = mercantile.children(250, 187, 9) + [(250, 187, 9)]
+                for x, y, z in tiles:
+                    key = tile_cache_key(z, x, y, **params)
+                    self.assertIsNotNone(cache.get(key))
+                # Incomplete overviews are not cached.
+                self.assertIsNotNone(render_cached_overview(8, 125, 93, params))
+                self.assertIsNone(cache.get(tile_cache_key(8, 125, 93, **params)))
+
+    def test_render_current_overview(self):
+        params = parse_tile_parameters({"end": "2021-01-01"}, "sentinel-2")
+        read = mock.Mock(side_effect=first_valid_pixel)
+        with mock.patch("wmts.tiles.first_valid_pixel", read):
+            data = render_current_overview(9, 250, 187, params)
+        read.assert_called_once()
+        self.assertEqual(decode(data)[0].shape, (3, 256, 256))
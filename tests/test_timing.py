@@ -0,0 +1,34 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, override_settings
+from wmts import timing
+
+
+class TimingTests(SimpleTestCase):
+    def test_nested_stages(self):
+        timer = timing.Timer()
+        with mock.patch("time.perf_counter", side_effect=[1, 2, 4, 7]):
+            with timer.stage("read"):
+                with timer.stage("search"):
+                    pass
+        # The search is not included in the read duration.
+        self.assertEqual(timer.durations, {"search": 2, "read": 4})
+
+    @override_settings(WMTS_TIMING_SAMPLE_RATE=1)
+    def test_sampled_request(self):
+        timing.start()
+        with timing.stage("encode"):
+            timing.count("read_bytes", 1024)
+        response = timing.finish(HttpResponse(), z=12)
+        metrics = [
+            metric.split(";")[0] for metric in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(metrics, ["encode", "read_bytes", "total"])
+
+    @override_settings(WMTS_TIMING_SAMPLE_RATE=0)
+    def test_request_not_sampled(self):
+        self.assertIsNone(timing.start())
+        with timing.stage("encode"):
+            timing.count("read_bytes", 1024)
+        self.assertNotIn("Server-Timing", timing.finish(HttpResponse()))
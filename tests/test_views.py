@@ -0,0 +1,86 @@
+import datetime
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework import status
+from wmts import const
+from wmts.cache import DiskTileCache
+
+
+class TileViewTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.usr = User.objects.create_user(
+            username="michael",
+            email="michael@bluth.com",
+            password="bananastand",
+        )
+        self.client.login(username="michael", password="bananastand")
+        # Render tiles without data into a temporary tile cache.
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch(
+            "wmts.views.get_tile_cache",
+            return_value=DiskTileCache(self.tmp.name, max_size=10**6),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            "wmts.tiles.first_valid_pixel", return_value=({}, None, None)
+        )
+        self.first_valid_pixel = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_historical_tile(self):
+        url = "/tiles/12/2000/1500.png?end=2021-01-01"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(self.first_valid_pixel.called)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn(
+            "max-age={}".format(const.TILE_MAX_AGE), response["Cache-Control"]
+        )
+        # Conditional requests are answered without rendering.
+        self.first_valid_pixel.reset_mock()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(self.first_valid_pixel.called)
+        self.assertIn(
+            "max-age={}".format(const.TILE_MAX_AGE), response["Cache-Control"]
+        )
+
+    def test_current_tile(self):
+        today = str(datetime.datetime.now().date())
+        url = "/tiles/12/2000/1500.png?end={}".format(today)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(self.first_valid_pixel.called)
+        # The ETag of current tiles changes daily.
+        self.assertTrue(response["ETag"].endswith('-{}"'.format(today)))
+        self.assertIn(
+            "max-age={}".format(const.CURRENT_TILE_MAX_AGE), response["Cache-Control"]
+        )
+        self.first_valid_pixel.reset_mock()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(self.first_valid_pixel.called)
+        # A different tile does not match the ETag.
+        etag = response["ETag"]
+        response = self.client.get(
+            "/tiles/12/2000/1501.png?end={}".format(today), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(self.first_valid_pixel.called)
+
+    def test_capabilities(self):
+        response = self.client.get("/wmts")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            "max-age={}".format(const.CAPABILITIES_MAX_AGE), response["Cache-Control"]
+        )
+        response = self.client.get("/wmts", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
@@ -0,0 +1,80 @@
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from wmts import wmts
+from wmts.utils import (
+    EMPTY_TILE,
+    ZOOM_IN_TILE,
+    get_empty_response,
+    negotiate_tile_format,
+)
+
+
+class WmtsCapabilitiesTests(SimpleTestCase):
+    def setUp(self):
+        wmts.gen_cached.cache_clear()
+
+    def test_gen_substitutes_key(self):
+        xml = wmts.gen("userkey", "https://example.com", 30, "SENTINEL_2")
+        self.assertNotIn(wmts.KEY_PLACEHOLDER, xml)
+        self.assertIn(
+            "https://example.com/tiles/SENTINEL_2/{TileMatrix}/{TileCol}/{TileRow}"
+            ".png?key=userkey&amp;end=2020-01-01&amp;max_cloud_cover_percentage=30",
+            xml,
+        )
+
+    def test_gen_shares_document_between_keys(self):
+        xml1 = wmts.gen("key1", "https://example.com")
+        xml2 = wmts.gen("key2", "https://example.com")
+        self.assertEqual(xml1.replace("key1", "key2"), xml2)
+        info = wmts.gen_cached.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+    def test_tile_matrix_set(self):
+        self.assertEqual(
+            wmts.TILE_MATRIX_SET.count("<TileMatrix>"), wmts.const.WMTS_MAX_ZOOM + 1
+        )
+        self.assertIn(
+            "<ScaleDenominator>1066.364791924892</ScaleDenominator>",
+            wmts.TILE_MATRIX_SET,
+        )
+
+    def test_gen_formats(self):
+        xml = wmts.gen("userkey", "https://example.com")
+        self.assertIn("<Format>image/webp</Format>", xml)
+        self.assertIn(
+            '<ResourceURL format="image/jpeg" template="https://example.com/tiles/'
+            "{TileMatrix}/{TileCol}/{TileRow}.jpg?key=userkey",
+            xml,
+        )
+
+
+class TileFormatNegotiationTests(SimpleTestCase):
+    def negotiate(self, accept, frmt="png"):
+        request = RequestFactory().get("/", HTTP_ACCEPT=accept)
+        return negotiate_tile_format(request, frmt)
+
+    @override_settings(WMTS_TILE_NEGOTIATION=True)
+    def test_negotiate_tile_format(self):
+        self.assertEqual(self.negotiate("image/avif,image/webp,*/*;q=0.8"), "webp")
+        self.assertEqual(self.negotiate("*/*"), "png")
+        self.assertEqual(self.negotiate("image/webp", frmt="jpg"), "jpg")
+
+    @override_settings(WMTS_TILE_NEGOTIATION=False)
+    def test_negotiate_tile_format_disabled(self):
+        self.assertEqual(self.negotiate("image/webp"), "png")
+
+
+class PlaceholderTileTests(SimpleTestCase):
+    def test_placeholder_images(self):
+        self.assertEqual(get_empty_response().content, ZOOM_IN_TILE)
+        self.assertEqual(get_empty_response(zoom=False).content, EMPTY_TILE)
+
+    def test_placeholder_transparent(self):
+        response = get_empty_response(placeholder="transparent")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertLess(len(response.content), 100)
+
+    def test_placeholder_none(self):
+        response = get_empty_response(placeholder="none")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.has_header("Content-Type"))